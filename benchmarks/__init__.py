@@ -0,0 +1,4 @@
+"""Offline benchmark harness for the bot plugins.
+
+Run with ``python -m benchmarks.run --help``.
+"""
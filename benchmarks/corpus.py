@@ -0,0 +1,77 @@
+"""Synthetic media corpus generated with ffmpeg ``lavfi`` sources and Pillow"""
+import os
+import subprocess
+from typing import Dict
+
+from PIL import Image, ImageDraw
+
+
+def _ffmpeg(*args: str):
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args], check=True)
+
+
+def make_mp4(path: str, seconds: int, size: str = "1280x720", faststart: bool = False):
+    """H.264/AAC test pattern; `faststart` controls where the moov atom lands"""
+    args = [
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", str(seconds),
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k",
+    ]
+    if faststart:
+        args += ["-movflags", "+faststart"]
+    _ffmpeg(*args, path)
+
+
+def make_mp3(path: str, seconds: int):
+    _ffmpeg(
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", str(seconds), "-c:a", "libmp3lame", "-b:a", "192k", path,
+    )
+
+
+def make_jpeg(path: str, width: int, height: int):
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, width, max(width // 16, 1)):
+        draw.line([(i, 0), (width - i, height)], fill=(i % 255, 80, 200), width=3)
+    img.save(path, "JPEG", quality=90)
+
+
+def make_pdf(path: str, pages: int):
+    frames = []
+    for i in range(pages):
+        page = Image.new("RGB", (1240, 1754), "white")
+        ImageDraw.Draw(page).text((100, 100), f"Benchmark page {i + 1}", fill="black")
+        frames.append(page)
+    frames[0].save(path, "PDF", save_all=True, append_images=frames[1:])
+
+
+def build_corpus(root: str, video_seconds: int = 20, audio_seconds: int = 120,
+                 image_size: int = 4000, pdf_pages: int = 20) -> Dict[str, str]:
+    """Create (or reuse) the fixture set under `root` and return name -> path"""
+    root = os.path.abspath(root)
+    tag = f"v{video_seconds}_a{audio_seconds}_i{image_size}_p{pdf_pages}"
+    base = os.path.join(root, tag)
+    os.makedirs(base, exist_ok=True)
+
+    fixtures = {
+        "video.mp4": lambda p: make_mp4(p, video_seconds),
+        "video_faststart.mp4": lambda p: make_mp4(p, video_seconds, faststart=True),
+        "video_b.mp4": lambda p: make_mp4(p, video_seconds),
+        "audio.mp3": lambda p: make_mp3(p, audio_seconds),
+        "audio_b.mp3": lambda p: make_mp3(p, audio_seconds),
+        "photo.jpg": lambda p: make_jpeg(p, image_size, image_size * 3 // 4),
+        "doc.pdf": lambda p: make_pdf(p, pdf_pages),
+        "doc_b.pdf": lambda p: make_pdf(p, pdf_pages),
+    }
+    paths = {}
+    for name, make in fixtures.items():
+        path = os.path.join(base, name)
+        if not os.path.exists(path):
+            tmp = path + ".part" + os.path.splitext(name)[1]
+            make(tmp)
+            os.replace(tmp, path)
+        paths[name] = path
+    return paths
@@ -0,0 +1,415 @@
+"""Local stand-ins for the Pyrogram Client and the Mongo database.
+
+Only the surface used by ``plugins/`` is implemented. Transfers are served
+from disk through a shared simulated link so concurrent jobs compete for
+bandwidth the same way they do in production.
+"""
+import asyncio
+import copy
+import itertools
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+CHUNK_SIZE = 1024 * 1024  # Same part size Pyrogram uses for downloads
+
+
+# ------------------ Network ------------------
+class Link:
+    """Shared simulated link with fixed bandwidth (bytes/s) and per-call latency"""
+
+    def __init__(self, bandwidth: float, latency: float = 0.0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self._next_free = 0.0
+        self.bytes = 0
+
+    async def rtt(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def transfer(self, nbytes: int):
+        """Wait until `nbytes` have gone through the link"""
+        self.bytes += nbytes
+        if not self.bandwidth:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_free)
+        self._next_free = start + nbytes / self.bandwidth
+        await asyncio.sleep(self._next_free - now)
+
+
+# ------------------ Telegram objects ------------------
+class FakeUser:
+    def __init__(self, user_id: int, username: str = ""):
+        self.id = user_id
+        self.username = username or f"user{user_id}"
+        self.first_name = self.username
+        self.mention = f"@{self.username}"
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeMedia:
+    """Document/video/audio attribute backed by a file on disk"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, path: str, file_name: Optional[str] = None, mime_type: str = "",
+                 file_unique_id: Optional[str] = None, **attrs):
+        n = next(self._ids)
+        self.path = path
+        self.file_name = file_name or os.path.basename(path)
+        self.file_size = os.path.getsize(path)
+        self.file_id = f"fake-file-{n}"
+        self.file_unique_id = file_unique_id or f"fake-unique-{n}"
+        self.mime_type = mime_type
+        for key, value in attrs.items():
+            setattr(self, key, value)
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, client: "FakeClient", chat_id: int, from_user: Optional[FakeUser] = None,
+                 text: str = "", reply_to_message: Optional["FakeMessage"] = None,
+                 document: Optional[FakeMedia] = None, video: Optional[FakeMedia] = None,
+                 audio: Optional[FakeMedia] = None, photo: Optional[FakeMedia] = None):
+        self._client = client
+        self.id = next(self._ids)
+        self.chat = FakeChat(chat_id)
+        self.from_user = from_user
+        self.text = text
+        self.command = text[1:].split() if text.startswith("/") else None
+        self.reply_to_message = reply_to_message
+        self.document = document
+        self.video = video
+        self.audio = audio
+        self.photo = photo
+        self.deleted = False
+        client.messages[(chat_id, self.id)] = self
+
+    @property
+    def media(self) -> Optional[FakeMedia]:
+        return self.document or self.video or self.audio or self.photo
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        return await self._client.send_message(self.chat.id, text, **kwargs)
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._client.record("edit_text", self.chat.id, text=text)
+        self.text = text
+        return self
+
+    async def delete(self, *args, **kwargs):
+        await self._client.record("delete", self.chat.id)
+        self.deleted = True
+
+
+# ------------------ Client ------------------
+class FakeClient:
+    """Minimal Pyrogram ``Client`` replacement serving media from disk"""
+
+    def __init__(self, downlink: Link, uplink: Link, api_latency: float = 0.0,
+                 download_dir: str = "downloads"):
+        self.downlink = downlink
+        self.uplink = uplink
+        self.api_latency = api_latency
+        self.download_dir = download_dir
+        self.messages: Dict[Any, FakeMessage] = {}
+        self.calls: List[Dict] = []
+        self.me = FakeUser(1, "benchbot")
+
+    async def record(self, method: str, chat_id: int, **info):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        self.calls.append({"method": method, "chat_id": chat_id, "time": time.monotonic(), **info})
+
+    def calls_for(self, chat_id: int) -> List[Dict]:
+        return [c for c in self.calls if c["chat_id"] == chat_id]
+
+    async def get_me(self) -> FakeUser:
+        return self.me
+
+    async def get_messages(self, chat_id: int, message_ids):
+        await self.record("get_messages", chat_id)
+        if isinstance(message_ids, (list, tuple)):
+            return [self.messages.get((chat_id, i)) for i in message_ids]
+        return self.messages.get((chat_id, message_ids))
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        await self.record("send_message", chat_id, text=text)
+        return FakeMessage(self, chat_id, from_user=self.me, text=text)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs) -> FakeMessage:
+        return await self.messages[(chat_id, message_id)].edit_text(text, **kwargs)
+
+    # ---------- Downloads ----------
+    async def stream_media(self, message: FakeMessage, limit: int = 0, offset: int = 0):
+        media = message.media
+        await self.downlink.rtt()
+        with open(media.path, "rb") as f:
+            f.seek(offset * CHUNK_SIZE)
+            sent = 0
+            while not limit or sent < limit:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                await self.downlink.transfer(len(chunk))
+                sent += 1
+                yield chunk
+
+    async def download_media(self, message: FakeMessage, file_name: str = "", in_memory: bool = False,
+                             block: bool = True, progress=None, progress_args=()) -> Optional[str]:
+        media = message.media
+        if not file_name or file_name.endswith(os.sep):
+            file_name = os.path.join(file_name or self.download_dir, media.file_name)
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        done = 0
+        with open(file_name, "wb") as out:
+            async for chunk in self.stream_media(message):
+                out.write(chunk)
+                done += len(chunk)
+                if progress:
+                    await progress(done, media.file_size, *progress_args)
+        await self.record("download_media", message.chat.id, bytes=done)
+        return os.path.abspath(file_name)
+
+    # ---------- Uploads ----------
+    async def _upload(self, method: str, chat_id: int, path, **kwargs) -> FakeMessage:
+        size = 0
+        if isinstance(path, str):
+            await self.uplink.rtt()
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    await self.uplink.transfer(len(chunk))
+            media = FakeMedia(path, file_name=kwargs.get("file_name"))
+        else:
+            media = None
+        await self.record(method, chat_id, bytes=size, file_name=kwargs.get("file_name"),
+                          caption=kwargs.get("caption"),
+                          **{k: kwargs[k] for k in ("duration", "width", "height") if k in kwargs})
+        kind = {"send_document": "document", "send_video": "video", "send_audio": "audio"}[method]
+        return FakeMessage(self, chat_id, from_user=self.me, **{kind: media})
+
+    async def send_document(self, chat_id: int, document, **kwargs) -> FakeMessage:
+        return await self._upload("send_document", chat_id, document, **kwargs)
+
+    async def send_video(self, chat_id: int, video, **kwargs) -> FakeMessage:
+        return await self._upload("send_video", chat_id, video, **kwargs)
+
+    async def send_audio(self, chat_id: int, audio, **kwargs) -> FakeMessage:
+        return await self._upload("send_audio", chat_id, audio, **kwargs)
+
+
+# ------------------ Mongo ------------------
+def _get(doc: Dict, dotted: str):
+    for part in dotted.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def _set(doc: Dict, dotted: str, value):
+    parts = dotted.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _matches(doc: Dict, query: Dict) -> bool:
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = _get(doc, key)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            for op, arg in cond.items():
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$nin" and value in arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+                if op == "$exists" and (value is not None) != arg:
+                    return False
+                if op in ("$lt", "$lte", "$gt", "$gte"):
+                    if value is None:
+                        return False
+                    if op == "$lt" and not value < arg:
+                        return False
+                    if op == "$lte" and not value <= arg:
+                        return False
+                    if op == "$gt" and not value > arg:
+                        return False
+                    if op == "$gte" and not value >= arg:
+                        return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _apply(doc: Dict, update: Dict):
+    for key, value in update.get("$set", {}).items():
+        _set(doc, key, value)
+    for key, value in update.get("$inc", {}).items():
+        _set(doc, key, (_get(doc, key) or 0) + value)
+    for key in update.get("$unset", {}):
+        parts = key.split(".")
+        parent = _get(doc, ".".join(parts[:-1])) if len(parts) > 1 else doc
+        if isinstance(parent, dict):
+            parent.pop(parts[-1], None)
+    for key, value in update.get("$push", {}).items():
+        current = _get(doc, key) or []
+        _set(doc, key, current + [value])
+
+
+class _Result:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class FakeCursor:
+    def __init__(self, docs: List[Dict]):
+        self._docs = docs
+
+    def sort(self, key: str, direction: int = 1) -> "FakeCursor":
+        self._docs.sort(key=lambda d: (_get(d, key) is None, _get(d, key)), reverse=direction < 0)
+        return self
+
+    def limit(self, n: int) -> "FakeCursor":
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        return self._docs[:length] if length else self._docs
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    """In-memory collection with the subset of the Motor API the bot uses"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs: List[Dict] = []
+        self.ops = 0
+
+    async def _rtt(self):
+        self.ops += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def find_one(self, query: Dict, *args, **kwargs) -> Optional[Dict]:
+        await self._rtt()
+        for doc in self.docs:
+            if _matches(doc, query):
+                return copy.copy(doc)
+        return None
+
+    def find(self, query: Optional[Dict] = None, *args, **kwargs) -> FakeCursor:
+        self.ops += 1
+        return FakeCursor([copy.copy(d) for d in self.docs if _matches(d, query or {})])
+
+    async def insert_one(self, doc: Dict) -> _Result:
+        await self._rtt()
+        doc.setdefault("_id", next(self._ids))
+        self.docs.append(copy.copy(doc))
+        return _Result(inserted_id=doc["_id"])
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False) -> _Result:
+        await self._rtt()
+        for doc in self.docs:
+            if _matches(doc, query):
+                _apply(doc, update)
+                return _Result(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith("$")}
+            doc["_id"] = next(self._ids)
+            _apply(doc, update)
+            self.docs.append(doc)
+            return _Result(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return _Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query: Dict, update: Dict) -> _Result:
+        await self._rtt()
+        matched = [d for d in self.docs if _matches(d, query)]
+        for doc in matched:
+            _apply(doc, update)
+        return _Result(matched_count=len(matched), modified_count=len(matched))
+
+    async def find_one_and_update(self, query: Dict, update: Dict, sort=None,
+                                  return_document: bool = False, upsert: bool = False) -> Optional[Dict]:
+        await self._rtt()
+        candidates = [d for d in self.docs if _matches(d, query)]
+        for key, direction in reversed(sort or []):
+            candidates.sort(key=lambda d: (_get(d, key) is None, _get(d, key)), reverse=direction < 0)
+        if not candidates:
+            return None
+        doc = candidates[0]
+        before = copy.deepcopy(doc)
+        _apply(doc, update)
+        return copy.copy(doc) if return_document else before
+
+    async def delete_one(self, query: Dict) -> _Result:
+        await self._rtt()
+        for i, doc in enumerate(self.docs):
+            if _matches(doc, query):
+                del self.docs[i]
+                return _Result(deleted_count=1)
+        return _Result(deleted_count=0)
+
+    async def delete_many(self, query: Dict) -> _Result:
+        await self._rtt()
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not _matches(d, query)]
+        return _Result(deleted_count=before - len(self.docs))
+
+    async def count_documents(self, query: Dict) -> int:
+        await self._rtt()
+        return sum(1 for d in self.docs if _matches(d, query))
+
+    async def create_index(self, *args, **kwargs) -> str:
+        return "fake_index"
+
+
+class FakeDB:
+    """Attribute/item access returns a lazily created ``FakeCollection``"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self.latency)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    @property
+    def ops(self) -> int:
+        return sum(c.ops for c in self._collections.values())
@@ -0,0 +1,394 @@
+"""Drive the plugin handlers offline and report per-scenario performance.
+
+Each scenario runs in its own subprocess (fresh working directory, fresh
+``ru_maxrss``) against ``FakeClient``/``FakeDB``. Results are written as JSON
+so runs can be compared with ``--compare``.
+
+Examples:
+    python -m benchmarks.run
+    python -m benchmarks.run -s rename_mp4 -s combine_mp4 -c 1 -c 8 --bandwidth 20
+    python -m benchmarks.run --compare bench_results.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fakes import FakeClient, FakeDB, FakeMedia, FakeMessage, FakeUser, Link
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+WATERMARK = {
+    "watermark_text": "@BenchChannel",
+    "watermark_position": "bottom-right",
+    "watermark_opacity": 60,
+    "watermark_size": 48,
+}
+METADATA = {"metadata_title": "Bench Title", "metadata_artist": "Bench Artist", "metadata_album": "Bench"}
+
+# name -> (handler, command, media kind, fixtures, extra user settings[, shared])
+# "shared" scenarios have every job send the same Telegram file (same file_unique_id)
+SCENARIOS: Dict[str, Dict] = {
+    "rename_mp4": dict(handler="rename_file", command="/rename Renamed", kind="video",
+                       fixtures=["video.mp4"], settings={}),
+    "rename_mp4_watermark": dict(handler="rename_file", command="/rename Renamed", kind="video",
+                                 fixtures=["video.mp4"], settings=WATERMARK),
+    "rename_mp3_metadata": dict(handler="rename_file", command="/rename Renamed", kind="document",
+                                fixtures=["audio.mp3"], settings=METADATA),
+    "rename_jpeg_watermark": dict(handler="rename_file", command="/rename Renamed", kind="document",
+                                  fixtures=["photo.jpg"], settings={**WATERMARK, "auto_thumbnail": True}),
+    "rename_pdf": dict(handler="rename_file", command="/rename Renamed", kind="document",
+                       fixtures=["doc.pdf"], settings={}),
+    "rename_mp4_shared": dict(handler="rename_file", command="/rename Renamed", kind="video",
+                              fixtures=["video.mp4"], settings={}, shared=True),
+    "showmetadata_mp4": dict(handler="show_metadata_handler", command="/showmetadata", kind="video",
+                             fixtures=["video.mp4"], settings={}),
+    "showmetadata_mp4_shared": dict(handler="show_metadata_handler", command="/showmetadata", kind="video",
+                                    fixtures=["video.mp4"], settings={}, shared=True),
+    "combine_mp4": dict(handler="finish_combine_handler", command="/finishcombine Combined", kind="video",
+                        fixtures=["video.mp4", "video_b.mp4"], settings={}),
+    "combine_mp4_faststart": dict(handler="finish_combine_handler", command="/finishcombine Combined", kind="video",
+                                  fixtures=["video_faststart.mp4", "video_faststart.mp4"], settings={}),
+    "combine_mp3": dict(handler="finish_combine_handler", command="/finishcombine Combined", kind="document",
+                        fixtures=["audio.mp3", "audio_b.mp3"], settings={}),
+    "combine_pdf": dict(handler="finish_combine_handler", command="/finishcombine Combined", kind="document",
+                        fixtures=["doc.pdf", "doc_b.pdf"], settings={}),
+}
+
+UPLOAD_METHODS = ("send_document", "send_video", "send_audio")
+
+
+# ------------------ Measurement ------------------
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _rss_kb(pid: str) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _children_rss_kb() -> int:
+    """Current RSS of direct child processes (ffmpeg, pdftk)"""
+    me = str(os.getpid())
+    total = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                ppid = f.read().rsplit(")", 1)[1].split()[1]
+        except (OSError, IndexError):
+            continue
+        if ppid == me:
+            total += _rss_kb(pid)
+    return total
+
+
+def _dir_bytes(path: str) -> int:
+    """Bytes used under `path`, counting hardlinked files once"""
+    total = 0
+    seen = set()
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+class Sampler:
+    """Polls RSS and scratch-disk usage while a scenario runs"""
+
+    def __init__(self, workdir: str, interval: float):
+        self.workdir = workdir
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.peak_children_rss_kb = 0
+        self.peak_disk_bytes = 0
+        self._task = None
+
+    def sample(self):
+        self.peak_rss_kb = max(self.peak_rss_kb, _rss_kb("self"))
+        self.peak_children_rss_kb = max(self.peak_children_rss_kb, _children_rss_kb())
+        self.peak_disk_bytes = max(self.peak_disk_bytes, _dir_bytes(self.workdir))
+
+    async def _loop(self):
+        while True:
+            await asyncio.to_thread(self.sample)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.sample()
+
+
+# ------------------ Scenario execution ------------------
+async def _seed_user(db: FakeDB, user_id: int, settings: Dict):
+    from plugins import rename
+
+    await rename.get_user_settings(user_id, db)
+    if settings:
+        await rename.update_user_settings(user_id, settings, db)
+
+
+async def run_job(rename, client: FakeClient, db: FakeDB, spec: Dict, corpus: Dict[str, str], index: int) -> Dict:
+    user_id = 100000 + index
+    user = FakeUser(user_id)
+    sources = [
+        FakeMessage(client, user_id, from_user=user, **{spec["kind"]: FakeMedia(
+            corpus[name], file_unique_id=f"shared-{name}" if spec.get("shared") else None
+        )})
+        for name in spec["fixtures"]
+    ]
+    settings = dict(spec["settings"])
+    if spec["handler"] == "finish_combine_handler":
+        settings.update({
+            "combine_mode": True,
+            "combine_type": os.path.splitext(spec["fixtures"][0])[1],
+            "combine_files": [rename.file_ref(m) for m in sources],
+        })
+    await _seed_user(db, user_id, settings)
+    command = FakeMessage(client, user_id, from_user=user, text=spec["command"], reply_to_message=sources[0])
+
+    handler = getattr(rename, spec["handler"])
+    error = None
+    start = time.monotonic()
+    try:
+        # Handlers only enqueue; the job is finished once a worker marks it so.
+        # Called directly with the fake db, unlike Pyrogram's dispatcher, which
+        # passes only (client, message): this doesn't check handler signatures.
+        await handler(client, command, db)
+        job = None
+        while job is None or job["status"] not in ("done", "failed"):
+            await asyncio.sleep(0.01)
+            job = await db.jobs.find_one({"chat_id": user_id})
+            if job is None:
+                error = "nothing enqueued"
+                break
+        if job and job["status"] == "failed":
+            error = job.get("error")
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    latency = time.monotonic() - start
+
+    calls = client.calls_for(user_id)
+    if error is None:
+        failures = [c["text"] for c in calls if c["method"] in ("send_message", "edit_text") and c["text"].startswith("❌")]
+        if failures:
+            error = failures[0]
+        elif spec["handler"] != "show_metadata_handler" and not any(c["method"] in UPLOAD_METHODS for c in calls):
+            error = "no upload"
+    return {
+        "latency": latency,
+        "error": error,
+        "bytes_in": sum(os.path.getsize(corpus[n]) for n in spec["fixtures"]),
+        "bytes_out": sum(c.get("bytes", 0) for c in calls if c["method"] in UPLOAD_METHODS),
+        "api_calls": len(calls),
+    }
+
+
+async def run_scenario(name: str, args) -> Dict:
+    spec = SCENARIOS[name]
+    corpus = build_corpus(args.corpus, args.video_seconds, args.audio_seconds, args.image_size, args.pdf_pages)
+    rename = importlib.import_module("plugins.rename")
+    from helpers.jobqueue import Worker
+
+    client = FakeClient(
+        downlink=Link(args.bandwidth * MB, args.net_latency),
+        uplink=Link(args.upload_bandwidth * MB if args.upload_bandwidth else args.bandwidth * MB, args.net_latency),
+        api_latency=args.api_latency,
+    )
+    db = FakeDB(latency=args.db_latency)
+    sampler = Sampler(os.getcwd(), args.sample_interval)
+    semaphore = asyncio.Semaphore(args.concurrency_value)
+
+    async def bounded(i):
+        async with semaphore:
+            return await run_job(rename, client, db, spec, corpus, i)
+
+    worker = Worker(client, db, args.concurrency_value)
+    worker.start()
+    sampler.start()
+    start = time.monotonic()
+    jobs = await asyncio.gather(*(bounded(i) for i in range(args.jobs)))
+    wall = time.monotonic() - start
+    await sampler.stop()
+    await worker.stop()
+
+    ok = [j for j in jobs if not j["error"]]
+    latencies = [j["latency"] for j in ok]
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "scenario": name,
+        "concurrency": args.concurrency_value,
+        "jobs": args.jobs,
+        "succeeded": len(ok),
+        "errors": sorted({j["error"] for j in jobs if j["error"]}),
+        "wall_s": round(wall, 4),
+        "throughput_jobs_s": round(len(ok) / wall, 4) if wall else None,
+        "throughput_in_mb_s": round(sum(j["bytes_in"] for j in ok) / MB / wall, 3) if wall else None,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p99_s": percentile(latencies, 99),
+        "latency_max_s": max(latencies) if latencies else None,
+        "peak_rss_kb": max(sampler.peak_rss_kb, usage_self.ru_maxrss),
+        "peak_children_rss_kb": sampler.peak_children_rss_kb,
+        "max_child_rss_kb": usage_children.ru_maxrss,
+        "peak_temp_bytes": sampler.peak_disk_bytes,
+        "cpu_user_s": round(usage_self.ru_utime + usage_children.ru_utime, 3),
+        "cpu_sys_s": round(usage_self.ru_stime + usage_children.ru_stime, 3),
+        "api_calls": sum(j["api_calls"] for j in jobs),
+        "db_ops": db.ops,
+    }
+
+
+# ------------------ Orchestration ------------------
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _spawn(name: str, concurrency: int, argv: List[str]) -> Dict:
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])))
+    cmd = [sys.executable, "-m", "benchmarks.run", "--child", name, "--concurrency-value", str(concurrency), *argv]
+    try:
+        proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"scenario": name, "concurrency": concurrency, "errors": [proc.stderr.strip()[-2000:]]}
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _fmt(value, scale: float = 1.0, digits: int = 2) -> str:
+    return "-" if value is None else f"{value * scale:.{digits}f}"
+
+
+def print_table(results: List[Dict], baseline: Optional[Dict] = None):
+    header = f"{'scenario':<24}{'conc':>5}{'ok':>6}{'jobs/s':>9}{'MB/s':>8}{'p50 s':>8}{'p99 s':>8}{'RSS MB':>8}{'disk MB':>9}"
+    if baseline:
+        header += f"{'Δp50':>8}{'Δjobs/s':>9}"
+    print(header)
+    for r in results:
+        line = (
+            f"{r['scenario']:<24}{r['concurrency']:>5}"
+            f"{str(r.get('succeeded', 0)) + '/' + str(r.get('jobs', '?')):>6}"
+            f"{_fmt(r.get('throughput_jobs_s')):>9}{_fmt(r.get('throughput_in_mb_s')):>8}"
+            f"{_fmt(r.get('latency_p50_s')):>8}{_fmt(r.get('latency_p99_s')):>8}"
+            f"{_fmt(r.get('peak_rss_kb'), 1 / 1024, 0):>8}{_fmt(r.get('peak_temp_bytes'), 1 / MB, 1):>9}"
+        )
+        old = baseline.get((r["scenario"], r["concurrency"])) if baseline else None
+        if old:
+            def delta(key):
+                if old.get(key) and r.get(key) is not None:
+                    return f"{(r[key] - old[key]) / old[key] * 100:+.0f}%"
+                return "-"
+            line += f"{delta('latency_p50_s'):>8}{delta('throughput_jobs_s'):>9}"
+        print(line)
+        for err in r.get("errors", []):
+            print(f"    ! {err.splitlines()[-1] if err else err}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("-c", "--concurrency", action="append", type=int,
+                        help="concurrent jobs (repeatable, default: 1 and 4)")
+    parser.add_argument("-n", "--jobs", type=int, default=8, help="jobs per scenario")
+    parser.add_argument("--bandwidth", type=float, default=50.0, help="download link in MB/s (0 = unlimited)")
+    parser.add_argument("--upload-bandwidth", type=float, default=0.0, help="upload link in MB/s (default: --bandwidth)")
+    parser.add_argument("--net-latency", type=float, default=0.05, help="per-transfer round trip in seconds")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="per bot API call latency in seconds")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="per Mongo operation latency in seconds")
+    parser.add_argument("--corpus", default=os.path.join(REPO_ROOT, ".bench_corpus"), help="fixture cache directory")
+    parser.add_argument("--video-seconds", type=int, default=20)
+    parser.add_argument("--audio-seconds", type=int, default=120)
+    parser.add_argument("--image-size", type=int, default=4000, help="JPEG width in pixels")
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--sample-interval", type=float, default=0.05)
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="previous results file to diff against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--concurrency-value", type=int, default=1, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.child:
+        result = asyncio.run(run_scenario(args.child, args))
+        print(json.dumps(result))
+        return
+
+    # Build fixtures once up front so no scenario pays for them
+    args.corpus = os.path.abspath(args.corpus)
+    build_corpus(args.corpus, args.video_seconds, args.audio_seconds, args.image_size, args.pdf_pages)
+    child_argv = ["--jobs", str(args.jobs), "--corpus", args.corpus]
+    for option in ("bandwidth", "upload_bandwidth", "net_latency", "api_latency", "db_latency",
+                   "video_seconds", "audio_seconds", "image_size", "pdf_pages", "sample_interval"):
+        child_argv += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+
+    results = []
+    for name in args.scenario or sorted(SCENARIOS):
+        for concurrency in args.concurrency or [1, 4]:
+            results.append(_spawn(name, concurrency, child_argv))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print_table(results, baseline)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "created": datetime.utcnow().isoformat() + "Z",
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("child", "concurrency_value")},
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,13 @@ import threading
 from flask import Flask
 from pyrogram import Client
 from pyrogram import utils as pyroutils
-from config import BOT, API, OWNER
+from config import BOT, API, OWNER, QUEUE
+from helpers import transfer
+from helpers.checkpoint import sweep_workspaces
+from helpers.source_cache import sweep_orphans
+from helpers.jobqueue import Worker
+from helpers.shutdown import coordinator
+from helpers.tracing import tracer
 
 # ✅ Peer ID Fix (for large channel/group IDs)
 pyroutils.MIN_CHAT_ID = -999999999999
@@ -24,7 +30,7 @@ def run_flask():
     app.run(host='0.0.0.0', port=8000)
 
 # ------------------ Bot Class ------------------
-class MN_Bot(Client):
+class MN_Bot(transfer.ParallelUploadMixin, Client):
     def __init__(self):
         super().__init__(
             "MN-Bot",
@@ -34,6 +40,7 @@ class MN_Bot(Client):
             plugins=dict(root="plugins"),
             workers=16,
         )
+        self.job_worker = None
 
     async def start(self):
         await super().start()
@@ -44,12 +51,29 @@ class MN_Bot(Client):
         await self.send_message(chat_id=OWNER.ID,
                                 text=f"{me.first_name} ✅✅ BOT started successfully ✅✅")
         logging.info(f"✅ {me.first_name} BOT started successfully")
+        tracer.start_monitor()
+
+        # Process queued jobs here too unless this instance is a pure front end
+        from plugins.rename import db, TEMP_DIR, source_cache
+        if QUEUE.LOCAL_SLOTS > 0:
+            await sweep_workspaces(db, TEMP_DIR)
+            source_cache.open()
+            sweep_orphans(TEMP_DIR)
+        # A front end still registers (with no slots) so workers leave it its share of the send rate
+        self.job_worker = Worker(self, db, QUEUE.LOCAL_SLOTS)
+        self.job_worker.start()
+        if QUEUE.LOCAL_SLOTS > 0:
+            logging.info(f"Local job worker started with {QUEUE.LOCAL_SLOTS} slots")
 
     async def stop(self, *args):
+        # Refuse new jobs, drain running ones, then kill leftover ffmpeg and clean up
+        from plugins.rename import TEMP_DIR
+        await coordinator.shutdown(self, self.job_worker, workspaces=TEMP_DIR)
         await super().stop()
         logging.info("Bot Stopped 🙄")
 
 # ------------------ Main ------------------
 if __name__ == "__main__":
-    threading.Thread(target=run_flask).start()
+    # Daemon thread, so the process exits once the bot has stopped
+    threading.Thread(target=run_flask, daemon=True).start()
     MN_Bot().run()
@@ -16,3 +16,62 @@ class OWNER:
 class WEB:
     PORT = int(os.environ.get("PORT", 8000))
 
+
+class TRANSFER:
+    # Files at least this big are moved as concurrent parts over several sessions
+    PARALLEL_THRESHOLD = int(os.environ.get("PARALLEL_THRESHOLD", 20 * 1024 * 1024))
+    PARALLEL = int(os.environ.get("TRANSFER_PARALLEL", 8))
+    SESSIONS = int(os.environ.get("TRANSFER_SESSIONS", 4))
+    RETRIES = int(os.environ.get("TRANSFER_RETRIES", 5))
+
+class RATE:
+    # Outgoing Telegram calls; defaults sit just under the documented bot limits.
+    # GLOBAL_PER_SEC is for the whole bot, split between the bot and worker.py processes online
+    GLOBAL_PER_SEC = float(os.environ.get("RATE_GLOBAL_PER_SEC", 25))
+    CHAT_PER_SEC = float(os.environ.get("RATE_CHAT_PER_SEC", 1))
+    CHAT_BURST = float(os.environ.get("RATE_CHAT_BURST", 3))
+    GROUP_PER_MIN = float(os.environ.get("RATE_GROUP_PER_MIN", 20))
+    GROUP_BURST = float(os.environ.get("RATE_GROUP_BURST", 3))
+    MAX_FLOOD_RETRIES = int(os.environ.get("RATE_FLOOD_RETRIES", 5))
+
+class QUEUE:
+    # Job slots run inside the bot process itself; 0 makes it a pure front end
+    LOCAL_SLOTS = int(os.environ.get("LOCAL_SLOTS", 2))
+    # Job slots per `python worker.py` process
+    WORKER_SLOTS = int(os.environ.get("WORKER_SLOTS", 2))
+    LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 90))
+    HEARTBEAT_INTERVAL = int(os.environ.get("WORKER_HEARTBEAT_INTERVAL", 15))
+    POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2))
+    MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+    # How often download progress is written to the job's checkpoint
+    CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", 5))
+
+class SHUTDOWN:
+    # Seconds running jobs get to finish after SIGTERM before they are interrupted
+    # and requeued; keep it below the platform's kill timeout (30s on Heroku/Render)
+    DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", 20))
+    # Seconds a child process gets to exit after SIGTERM before it is killed
+    KILL_GRACE = float(os.environ.get("KILL_GRACE", 3))
+
+class TRACE:
+    # Jobs taking at least this long are listed by /perf (the last SLOW_JOBS of them)
+    SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", 30))
+    SLOW_JOBS = int(os.environ.get("TRACE_SLOW_JOBS", 20))
+    LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.5))
+    PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+    MAX_PROFILE_SECONDS = int(os.environ.get("MAX_PROFILE_SECONDS", 120))
+
+class COMBINE:
+    # Pipe MP4/MP3 inputs into ffmpeg while they download instead of staging them on disk
+    STREAMING = os.environ.get("STREAM_COMBINE", "true").lower() in ("1", "true", "yes")
+    # Streamed merges only write their output, so they may be larger than the on-disk limit
+    MAX_STREAM_SIZE = int(os.environ.get("MAX_STREAM_COMBINE_SIZE", 2000 * 1024 * 1024))
+    # 1 MB chunks buffered ahead of ffmpeg, per input being downloaded
+    READAHEAD = int(os.environ.get("COMBINE_READAHEAD", 8))
+
+class CACHE:
+    # Downloaded sources kept for repeat requests (by file_unique_id); files still
+    # linked into a job workspace don't count as evictable
+    SOURCE_BYTES = int(os.environ.get("SOURCE_CACHE_BYTES", 1024 * 1024 * 1024))
+    # Partial downloads nobody resumed within this many seconds are deleted
+    STALE_TEMP_SECONDS = int(os.environ.get("SOURCE_CACHE_STALE_TEMP", 6 * 3600))
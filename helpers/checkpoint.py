@@ -0,0 +1,109 @@
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable
+
+from config import QUEUE
+from helpers.tracing import span
+from helpers.transfer import ResumeLog
+
+log = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Progress of one job, persisted in ``job["checkpoint"]`` so a retry can resume.
+
+    Layout::
+
+        {"stages": ["processed", ...],          # finished stages, in order
+         "values": {"processed_path": ...},     # outputs recorded with a stage
+         "downloads": {"original": [0, 1, 2]}}  # finished download parts per file
+    """
+
+    def __init__(self, db, job: Dict):
+        self.jobs = db.jobs
+        self.job_id = job["_id"]
+        state = job.get("checkpoint") or {}
+        self.stages = list(state.get("stages", []))
+        self.values = dict(state.get("values", {}))
+        self.downloads = dict(state.get("downloads", {}))
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.stages or any(self.downloads.values()))
+
+    def reached(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+    def output(self, key: str) -> str:
+        """Path recorded under `key`, if that file still exists on this host"""
+        path = self.values.get(key)
+        return path if path and os.path.exists(path) else ""
+
+    async def complete(self, stage: str, **values):
+        """Record a finished stage and the outputs it produced"""
+        if stage not in self.stages:
+            self.stages.append(stage)
+        self.values.update(values)
+        update = {"checkpoint.stages": self.stages}
+        update.update({f"checkpoint.values.{k}": v for k, v in values.items()})
+        with span("mongo"):
+            await self.jobs.update_one({"_id": self.job_id}, {"$set": update})
+
+    def download(self, key: str) -> "DownloadLog":
+        return DownloadLog(self, key, self.downloads.get(key, []))
+
+
+class DownloadLog(ResumeLog):
+    """Download parts of one file, flushed to the job document every few seconds"""
+
+    def __init__(self, checkpoint: Checkpoint, key: str, parts: Iterable[int]):
+        super().__init__(parts)
+        self.checkpoint = checkpoint
+        self.key = key
+        self.flushed_at = time.monotonic()
+        self.dirty = False
+
+    def reset(self):
+        super().reset()
+        self.dirty = True
+
+    async def part_done(self, part: int):
+        await super().part_done(part)
+        self.dirty = True
+        if time.monotonic() - self.flushed_at >= QUEUE.CHECKPOINT_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        parts = sorted(self.parts)
+        self.dirty = False
+        self.flushed_at = time.monotonic()
+        self.checkpoint.downloads[self.key] = parts
+        try:
+            await self.checkpoint.jobs.update_one(
+                {"_id": self.checkpoint.job_id},
+                {"$set": {f"checkpoint.downloads.{self.key}": parts}},
+            )
+        except Exception as e:
+            # Losing a flush only means refetching those parts after a crash
+            log.warning(f"Checkpoint flush failed for job {self.checkpoint.job_id}: {e}")
+
+
+async def sweep_workspaces(db, root: str, prefix: str = "job_"):
+    """Delete job workspaces under `root` whose job is no longer queued or running"""
+    if not os.path.isdir(root):
+        return
+    live = {
+        f"{prefix}{job['_id']}"
+        async for job in db.jobs.find({"status": {"$in": ["queued", "running"]}}, {"_id": 1})
+    }
+    for name in os.listdir(root):
+        if name.startswith(prefix) and name not in live:
+            log.info(f"Removing stale workspace {name}")
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
@@ -0,0 +1,115 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Font shipped by fonts-dejavu-core in the Docker image
+FALLBACK_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+THUMB_SIZE = (320, 320)
+MARGIN = 10
+
+# Pillow releases the GIL for decode/encode/composite, so a small pool keeps
+# large photos off the event loop without starving the bot's own workers
+_executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="imaging")
+
+
+@lru_cache(maxsize=32)
+def load_font(font_path: str, size: int) -> ImageFont.ImageFont:
+    """Load a TrueType font once per (path, size)"""
+    for path in (font_path, FALLBACK_FONT):
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=128)
+def render_text_patch(text: str, size: int, opacity: int, font_path: str) -> Image.Image:
+    """Pre-render watermark text into an RGBA patch the size of its bounding box.
+
+    The returned image is shared between calls and must not be modified.
+    """
+    font = load_font(font_path, size)
+    left, top, right, bottom = font.getbbox(text)
+    patch = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), (255, 255, 255, 0))
+    alpha = int(255 * max(0, min(opacity, 100)) / 100)
+    ImageDraw.Draw(patch).text((-left, -top), text, font=font, fill=(255, 255, 255, alpha))
+    return patch
+
+
+def patch_position(image_size: Tuple[int, int], patch_size: Tuple[int, int], position: str) -> Tuple[int, int]:
+    width, height = image_size
+    text_width, text_height = patch_size
+    positions = {
+        "top-left": (MARGIN, MARGIN),
+        "top-right": (width - text_width - MARGIN, MARGIN),
+        "bottom-left": (MARGIN, height - text_height - MARGIN),
+        "bottom-right": (width - text_width - MARGIN, height - text_height - MARGIN),
+        "center": ((width - text_width) // 2, (height - text_height) // 2),
+    }
+    x, y = positions.get(position, positions["bottom-right"])
+    return max(x, 0), max(y, 0)
+
+
+def _watermark_image(input_path: str, output_path: str, settings: Dict, font_path: str) -> bool:
+    patch = render_text_patch(
+        settings["watermark_text"],
+        int(settings.get("watermark_size", 20)),
+        int(settings.get("watermark_opacity", 50)),
+        font_path,
+    )
+    with Image.open(input_path) as img:
+        img.load()
+        source_format = img.format
+        save_kwargs = {k: img.info[k] for k in ("exif", "icc_profile", "dpi") if k in img.info}
+        if source_format == "JPEG":
+            # Re-use the source quantization tables instead of Pillow's default quality
+            save_kwargs["quality"] = "keep"
+            save_kwargs["subsampling"] = "keep"
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+            save_kwargs.pop("quality", None)
+            save_kwargs.pop("subsampling", None)
+
+        x, y = patch_position(img.size, patch.size, settings.get("watermark_position", "bottom-right"))
+        box = (x, y, min(x + patch.width, img.width), min(y + patch.height, img.height))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return False
+
+        # Composite only the text bounding box instead of a full-size overlay
+        region = img.crop(box).convert("RGBA")
+        region.alpha_composite(patch.crop((0, 0, box[2] - box[0], box[3] - box[1])))
+        img.paste(region.convert(img.mode), box[:2])
+        img.save(output_path, format=source_format, **save_kwargs)
+    return True
+
+
+def _make_thumbnail(file_path: str) -> BytesIO:
+    with Image.open(file_path) as img:
+        # Let libjpeg decode at 1/2..1/8 scale instead of full resolution
+        img.draft("RGB", THUMB_SIZE)
+        img.thumbnail(THUMB_SIZE)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        thumb = BytesIO()
+        img.save(thumb, "JPEG")
+    thumb.name = "thumbnail.jpg"
+    thumb.seek(0)
+    return thumb
+
+
+async def watermark_image(input_path: str, output_path: str, settings: Dict, font_path: str) -> bool:
+    """Draw the watermark text onto an image in the imaging thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _watermark_image, input_path, output_path, settings, font_path)
+
+
+async def make_thumbnail(file_path: str) -> Optional[BytesIO]:
+    """Build a JPEG thumbnail in the imaging thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _make_thumbnail, file_path)
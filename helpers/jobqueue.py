@@ -0,0 +1,335 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from config import QUEUE
+from helpers.ratelimit import limiter
+from helpers.tracing import JobTrace, current_trace, tracer
+
+log = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+FAILED_TEXT = "❌ Sorry, your job failed. Please send the command again."
+
+# kind -> async runner(client, job, db), filled in by @job_runner
+JOB_RUNNERS: Dict[str, Callable[..., Awaitable]] = {}
+
+# Wakes workers in this process as soon as a job is enqueued here
+_wakeup = asyncio.Event()
+
+
+def job_runner(kind: str):
+    """Register the coroutine that processes jobs of `kind`"""
+    def decorator(func):
+        JOB_RUNNERS[kind] = func
+        return func
+    return decorator
+
+
+class JobQueue:
+    """Mongo-backed job queue with atomic claims and expiring leases"""
+
+    def __init__(self, db):
+        self.jobs = db.jobs
+        self.workers = db.workers
+
+    async def ensure_indexes(self):
+        await self.jobs.create_index([("status", 1), ("created_at", 1)])
+        await self.jobs.create_index([("status", 1), ("lease_until", 1)])
+        await self.workers.create_index("worker_id", unique=True)
+        await self.jobs.create_index("trace.duration", sparse=True)
+
+    async def enqueue(self, kind: str, user_id: int, chat_id: int, payload: Dict) -> Dict:
+        now = datetime.utcnow()
+        job = {
+            "kind": kind,
+            "status": QUEUED,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "payload": payload,
+            "attempts": 0,
+            "worker_id": None,
+            "lease_until": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        result = await self.jobs.insert_one(job)
+        job["_id"] = result.inserted_id
+        _wakeup.set()
+        return job
+
+    async def claim(self, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[Dict]:
+        """Atomically take the oldest queued job, or one whose lease has expired"""
+        now = datetime.utcnow()
+        query = {
+            "$or": [
+                {"status": QUEUED},
+                {"status": RUNNING, "lease_until": {"$lt": now}},
+            ],
+            "attempts": {"$lt": QUEUE.MAX_ATTEMPTS},
+        }
+        if kinds:
+            query["kind"] = {"$in": kinds}
+        return await self.jobs.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "worker_id": worker_id,
+                    "lease_until": now + timedelta(seconds=QUEUE.LEASE_SECONDS),
+                    "started_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def heartbeat(self, job_id, worker_id: str, stage: Optional[str] = None) -> bool:
+        """Extend the lease (and record the current stage); False means another worker has taken the job over"""
+        now = datetime.utcnow()
+        update = {"lease_until": now + timedelta(seconds=QUEUE.LEASE_SECONDS), "updated_at": now}
+        if stage:
+            update["stage"] = stage
+        result = await self.jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": RUNNING},
+            {"$set": update},
+        )
+        return result.matched_count == 1
+
+    async def save_trace(self, job_id, trace: Dict):
+        await self.jobs.update_one({"_id": job_id}, {"$set": {"trace": trace}})
+
+    async def _finish(self, job_id, worker_id: str, status: str, error: Optional[str] = None):
+        now = datetime.utcnow()
+        await self.jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id},
+            {"$set": {"status": status, "error": error, "lease_until": None, "finished_at": now, "updated_at": now}},
+        )
+
+    async def complete(self, job_id, worker_id: str):
+        await self._finish(job_id, worker_id, DONE)
+
+    async def fail(self, job_id, worker_id: str, error: str):
+        await self._finish(job_id, worker_id, FAILED, error)
+
+    async def release(self, job_id, worker_id: str):
+        """Hand a running job back to the queue without counting the attempt"""
+        await self.jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": RUNNING},
+            {"$set": {"status": QUEUED, "worker_id": None, "lease_until": None, "updated_at": datetime.utcnow()},
+             "$inc": {"attempts": -1}},
+        )
+
+    async def requeue_expired(self) -> int:
+        """Put jobs with lost leases back in the queue, failing ones out of attempts"""
+        now = datetime.utcnow()
+        expired = {"status": RUNNING, "lease_until": {"$lt": now}}
+        failed = await self.jobs.update_many(
+            {**expired, "attempts": {"$gte": QUEUE.MAX_ATTEMPTS}},
+            {"$set": {"status": FAILED, "error": "lease lost too many times", "finished_at": now, "updated_at": now}},
+        )
+        requeued = await self.jobs.update_many(
+            expired,
+            {"$set": {"status": QUEUED, "worker_id": None, "lease_until": None, "updated_at": now}},
+        )
+        if requeued.modified_count or failed.modified_count:
+            log.warning(f"Requeued {requeued.modified_count} and failed {failed.modified_count} jobs with lost leases")
+        return requeued.modified_count
+
+    async def pending(self) -> int:
+        return await self.jobs.count_documents({"status": QUEUED})
+
+    async def running_jobs(self) -> List[Dict]:
+        return await self.jobs.find({"status": RUNNING}).to_list(length=None)
+
+    async def slow_jobs(self, seconds: float, limit: int) -> List[Dict]:
+        """The last `limit` finished jobs that took at least `seconds`, on any worker"""
+        cursor = self.jobs.find({"trace.duration": {"$gte": seconds}}).sort("finished_at", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    # ------------------ Workers ------------------
+    async def register_worker(self, worker_id: str, slots: int, running: int = 0):
+        await self.workers.update_one(
+            {"worker_id": worker_id},
+            {"$set": {
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "slots": slots,
+                "running": running,
+                "heartbeat_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+
+    async def unregister_worker(self, worker_id: str):
+        await self.workers.delete_one({"worker_id": worker_id})
+
+    async def live_workers(self) -> List[Dict]:
+        """Processes with a recent heartbeat, front ends (0 slots) included"""
+        alive_since = datetime.utcnow() - timedelta(seconds=QUEUE.HEARTBEAT_INTERVAL * 3)
+        return await self.workers.find({"heartbeat_at": {"$gte": alive_since}}).to_list(length=None)
+
+    async def stats(self) -> Dict:
+        workers = await self.live_workers()
+        return {
+            "queued": await self.pending(),
+            "running": await self.jobs.count_documents({"status": RUNNING}),
+            "workers": sum(1 for w in workers if w.get("slots")),
+            "slots": sum(w.get("slots", 0) for w in workers),
+            "busy": sum(w.get("running", 0) for w in workers),
+        }
+
+
+class Worker:
+    """Claims jobs from the queue and runs them with up to `slots` in parallel"""
+
+    def __init__(self, client, db, slots: int, worker_id: Optional[str] = None, kinds: Optional[List[str]] = None):
+        self.client = client
+        self.db = db
+        self.slots = slots
+        self.kinds = kinds
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.queue = JobQueue(db)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.jobs: Dict[str, Dict] = {}
+        self.running = False
+        self._loops: List[asyncio.Task] = []
+
+    def start(self):
+        self.running = True
+        self._loops = [asyncio.ensure_future(self._maintenance_loop())]
+        if self.slots > 0:
+            self._loops.append(asyncio.ensure_future(self._claim_loop()))
+
+    async def stop(self, timeout: float = 0) -> List[Dict]:
+        """Stop claiming and give running jobs `timeout` seconds to finish.
+
+        Jobs still running after that are cancelled and go back to the queue
+        for another worker; they are returned so the caller can tell their users.
+        """
+        self.running = False
+        _wakeup.set()
+        for task in self._loops:
+            task.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        if self.tasks and timeout > 0:
+            await asyncio.wait(list(self.tasks.values()), timeout=timeout)
+        interrupted = [self.jobs[key] for key, task in self.tasks.items() if not task.done()]
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*list(self.tasks.values()), return_exceptions=True)
+        await self.queue.unregister_worker(self.worker_id)
+        return interrupted
+
+    async def _claim_loop(self):
+        try:
+            await self.queue.ensure_indexes()
+        except Exception as e:
+            log.error(f"Job index creation error: {e}")
+        while self.running:
+            if len(self.tasks) >= self.slots:
+                await asyncio.wait(list(self.tasks.values()), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            _wakeup.clear()
+            try:
+                job = await self.queue.claim(self.worker_id, self.kinds)
+            except Exception as e:
+                log.error(f"Job claim error: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), QUEUE.POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            key = str(job["_id"])
+            self.jobs[key] = job
+            self.tasks[key] = asyncio.ensure_future(self._execute(job))
+            self.tasks[key].add_done_callback(lambda _, key=key: self._forget(key))
+
+    def _forget(self, key: str):
+        self.tasks.pop(key, None)
+        self.jobs.pop(key, None)
+
+    async def _maintenance_loop(self):
+        while self.running:
+            try:
+                await self.queue.register_worker(self.worker_id, self.slots, len(self.tasks))
+                # Every process logged in as the bot draws on the same per-bot send limit
+                limiter.share(len(await self.queue.live_workers()))
+                await self.queue.requeue_expired()
+            except Exception as e:
+                log.error(f"Worker maintenance error: {e}")
+            await asyncio.sleep(QUEUE.HEARTBEAT_INTERVAL)
+
+    async def _heartbeat(self, job: Dict, task: asyncio.Task, trace: JobTrace):
+        while True:
+            await asyncio.sleep(QUEUE.LEASE_SECONDS / 3)
+            try:
+                alive = await self.queue.heartbeat(job["_id"], self.worker_id, trace.stage)
+            except Exception as e:
+                log.error(f"Job heartbeat error: {e}")
+                continue
+            if not alive:
+                log.warning(f"Lost lease on job {job['_id']}, abandoning it")
+                task.cancel()
+                return
+
+    async def _notify_failed(self, job: Dict):
+        """Replace the job's status message with FAILED_TEXT, or send it if that message is gone"""
+        chat_id = job["chat_id"]
+        try:
+            await limiter.call(chat_id, self.client.edit_message_text, chat_id, job["payload"]["status_id"], FAILED_TEXT)
+            return
+        except Exception:
+            pass
+        try:
+            await limiter.call(chat_id, self.client.send_message, chat_id, FAILED_TEXT)
+        except Exception as e:
+            log.warning(f"Could not notify chat {chat_id} about failed job {job['_id']}: {e}")
+
+    async def _execute(self, job: Dict):
+        runner = JOB_RUNNERS.get(job["kind"])
+        if runner is None:
+            await self.queue.fail(job["_id"], self.worker_id, f"no runner for {job['kind']}")
+            return
+        trace = tracer.begin(job)
+        # The runner task copies this context, so span() inside it finds the trace
+        token = current_trace.set(trace)
+        work = asyncio.ensure_future(runner(self.client, job, self.db))
+        current_trace.reset(token)
+        heartbeat = asyncio.ensure_future(self._heartbeat(job, work, trace))
+        status = DONE
+        try:
+            await work
+        except asyncio.CancelledError:
+            status = "interrupted"
+            if self.running and not work.cancelled():
+                raise
+            # Lease lost or worker stopping: leave the job for someone else
+            if not self.running:
+                await self.queue.release(job["_id"], self.worker_id)
+            return
+        except Exception as e:
+            status = FAILED
+            log.exception(f"Job {job['_id']} ({job['kind']}) failed")
+            await self.queue.fail(job["_id"], self.worker_id, f"{type(e).__name__}: {e}")
+            await self._notify_failed(job)
+            return
+        finally:
+            heartbeat.cancel()
+            tracer.end(trace, status)
+            try:
+                await self.queue.save_trace(job["_id"], trace.to_doc())
+            except Exception as e:
+                log.error(f"Job trace save error: {e}")
+        await self.queue.complete(job["_id"], self.worker_id)
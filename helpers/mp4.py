@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import struct
+from typing import Dict, Iterator, NamedTuple
+
+log = logging.getLogger(__name__)
+
+# Outputs written by ffmpeg's mov-family muxers, which understand -movflags
+MP4_EXTENSIONS = (".mp4", ".m4v", ".mov", ".m4a")
+FASTSTART_FLAGS = ['-movflags', '+faststart']
+
+# Boxes on the path from moov down to the chunk offset tables
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+COPY_CHUNK = 4 * 1024 * 1024
+
+
+class Atom(NamedTuple):
+    kind: bytes
+    offset: int
+    size: int
+    header: int
+
+
+def _atoms(read, start: int, end: int) -> Iterator[Atom]:
+    """Boxes between `start` and `end`; `read(offset, n)` returns raw bytes"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack(">I4s", read(pos, 8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", read(pos + 8, 8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"corrupt {kind!r} box at {pos}")
+        yield Atom(kind, pos, size, header)
+        pos += size
+
+
+def _file_atoms(f) -> list:
+    end = os.fstat(f.fileno()).st_size
+
+    def read(offset: int, n: int) -> bytes:
+        f.seek(offset)
+        return f.read(n)
+
+    return list(_atoms(read, 0, end))
+
+
+def _buffer_atoms(data: bytearray, start: int, end: int) -> Iterator[Atom]:
+    return _atoms(lambda offset, n: bytes(data[offset:offset + n]), start, end)
+
+
+def _shift_chunk_offsets(data: bytearray, atom: Atom, shift: int, low: int, high: int):
+    """Add `shift` to every stco/co64 entry pointing into [low, high)"""
+    for child in _buffer_atoms(data, atom.offset + atom.header, atom.offset + atom.size):
+        if child.kind in _CONTAINERS:
+            _shift_chunk_offsets(data, child, shift, low, high)
+        elif child.kind in (b"stco", b"co64"):
+            fmt, width = (">I", 4) if child.kind == b"stco" else (">Q", 8)
+            body = child.offset + child.header
+            count = struct.unpack_from(">I", data, body + 4)[0]
+            for i in range(count):
+                pos = body + 8 + i * width
+                value = struct.unpack_from(fmt, data, pos)[0]
+                if low <= value < high:
+                    value += shift
+                    if width == 4 and value >= 1 << 32:
+                        raise ValueError("chunk offset no longer fits in stco")
+                    struct.pack_into(fmt, data, pos, value)
+
+
+def _copy_range(src, dst, start: int, length: int):
+    src.seek(start)
+    while length > 0:
+        block = src.read(min(COPY_CHUNK, length))
+        if not block:
+            raise ValueError("file ended early")
+        dst.write(block)
+        length -= len(block)
+
+
+def _relocate_moov(path: str, output_path: str) -> bool:
+    """Write `path` with moov in front of the media data to `output_path`.
+
+    A file with no other hard links is renamed and rewritten in place; a
+    shared one (e.g. linked from the source cache) is left untouched and a
+    relocated copy is written in a single pass. False, with nothing
+    written, if moov is already first or the file can't be relocated.
+    """
+    with open(path, "rb") as f:
+        atoms = _file_atoms(f)
+        moov = next((a for a in atoms if a.kind == b"moov"), None)
+        mdat = next((a for a in atoms if a.kind == b"mdat"), None)
+        if moov is None or mdat is None or mdat.offset > moov.offset:
+            return False
+        if any(a.kind == b"moof" for a in atoms):
+            # Fragmented files stream as they are
+            return False
+
+        f.seek(moov.offset)
+        data = bytearray(f.read(moov.size))
+        shifted = Atom(moov.kind, 0, moov.size, moov.header)
+        # Patch before touching the file, so an offset overflow leaves it intact
+        _shift_chunk_offsets(data, shifted, moov.size, mdat.offset, moov.offset)
+
+        stat = os.fstat(f.fileno())
+        if stat.st_nlink > 1:
+            moov_end = moov.offset + moov.size
+            with open(output_path, "wb") as out:
+                _copy_range(f, out, 0, mdat.offset)
+                out.write(data)
+                _copy_range(f, out, mdat.offset, moov.offset - mdat.offset)
+                _copy_range(f, out, moov_end, stat.st_size - moov_end)
+            return True
+
+    # Renamed first, so a rewrite cut short is never mistaken for the original
+    os.replace(path, output_path)
+    with open(output_path, "r+b") as f:
+        # Slide everything between the first mdat and moov up by moov's size,
+        # back to front so no block is overwritten before it has been copied
+        pos = moov.offset
+        while pos > mdat.offset:
+            n = min(COPY_CHUNK, pos - mdat.offset)
+            pos -= n
+            f.seek(pos)
+            block = f.read(n)
+            f.seek(pos + moov.size)
+            f.write(block)
+        f.seek(mdat.offset)
+        f.write(data)
+    return True
+
+
+def _probe(path: str) -> Dict[str, int]:
+    """Duration (seconds) and display width/height read from moov"""
+    info: Dict[str, int] = {}
+    with open(path, "rb") as f:
+        moov = next((a for a in _file_atoms(f) if a.kind == b"moov"), None)
+        if moov is None:
+            return info
+        f.seek(moov.offset)
+        data = bytearray(f.read(moov.size))
+
+    for atom in _buffer_atoms(data, moov.header, moov.size):
+        if atom.kind == b"mvhd":
+            body = atom.offset + atom.header
+            if data[body] == 1:
+                timescale, duration = struct.unpack_from(">IQ", data, body + 20)
+            else:
+                timescale, duration = struct.unpack_from(">II", data, body + 12)
+            if timescale:
+                info["duration"] = round(duration / timescale)
+        elif atom.kind == b"trak" and "width" not in info:
+            tkhd = next((a for a in _buffer_atoms(data, atom.offset + atom.header, atom.offset + atom.size)
+                         if a.kind == b"tkhd"), None)
+            if tkhd is None:
+                continue
+            body = tkhd.offset + tkhd.header
+            matrix = body + (52 if data[body] == 1 else 40)
+            a, b, _, c, d = struct.unpack_from(">5i", data, matrix)
+            width, height = (v >> 16 for v in struct.unpack_from(">II", data, matrix + 36))
+            if width and height:
+                # Rotated by 90/270 degrees: the player shows it the other way round
+                if a == 0 and d == 0:
+                    width, height = height, width
+                info["width"], info["height"] = width, height
+    return info
+
+
+async def faststart(path: str, output_path: str) -> bool:
+    """Put a fast-start version of an MP4 at `output_path`, off the event loop.
+
+    Returns False (and leaves `path` alone) when there is nothing to do.
+    """
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, _relocate_moov, path, output_path)
+    except (ValueError, struct.error) as e:
+        log.warning(f"Faststart skipped for {path}: {e}")
+    return False
+
+
+async def probe(path: str) -> Dict[str, int]:
+    """``duration``/``width``/``height`` for ``send_video``; empty when unknown"""
+    if not path.lower().endswith(MP4_EXTENSIONS):
+        return {}
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, _probe, path)
+    except (OSError, ValueError, struct.error) as e:
+        log.warning(f"Probe failed for {path}: {e}")
+    return {}
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from config import RATE
+
+log = logging.getLogger(__name__)
+
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking.
+
+    ``rate`` adapts: it is cut on FloodWait and creeps back up towards
+    ``base_rate`` on every successful call.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Take one token and return how long the caller must wait for it"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.rate = max(self.base_rate * 0.1, self.rate * 0.5)
+
+    def set_rate(self, rate: float, burst: float):
+        """Change the target rate, keeping any FloodWait cut in proportion"""
+        self.rate = rate * self.rate / self.base_rate
+        self.base_rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+    def success(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+
+class _PendingEdit:
+    def __init__(self, text: str, kwargs: Dict):
+        self.text = text
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class OutboundLimiter:
+    """Central gate for every outgoing Telegram call made by the plugins"""
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(RATE.GLOBAL_PER_SEC, max(RATE.GLOBAL_PER_SEC, 1))
+        self.chat_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.pending_edits: Dict[Tuple[int, int], _PendingEdit] = {}
+        self.last_text: "OrderedDict[Tuple[int, int], str]" = OrderedDict()
+        self.flood_waits = 0
+        self._detached = set()
+
+    def share(self, processes: int):
+        """Split the bot-wide rate evenly between `processes` processes using the same bot token"""
+        rate = RATE.GLOBAL_PER_SEC / max(processes, 1)
+        if rate != self.global_bucket.base_rate:
+            self.global_bucket.set_rate(rate, max(rate, 1))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(RATE.GROUP_PER_MIN / 60, RATE.GROUP_BURST)
+            else:
+                bucket = TokenBucket(RATE.CHAT_PER_SEC, RATE.CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > MAX_CHAT_BUCKETS:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id: int):
+        chat = self._chat_bucket(chat_id)
+        wait = max(chat.reserve(), self.global_bucket.reserve())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def call(self, chat_id: int, func: Callable[..., Awaitable], /, *args, **kwargs) -> Any:
+        """Run `func` under the chat and global buckets, retrying after FloodWait"""
+        return await self._invoke(chat_id, func, args, kwargs)
+
+    async def _invoke(self, chat_id: int, func: Callable[..., Awaitable], args: tuple, kwargs: Dict,
+                      acquired: bool = False) -> Any:
+        for attempt in range(RATE.MAX_FLOOD_RETRIES + 1):
+            if attempt or not acquired:
+                await self._acquire(chat_id)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWait as e:
+                if attempt == RATE.MAX_FLOOD_RETRIES:
+                    raise
+                self.flood_waits += 1
+                log.warning(f"FloodWait {e.value}s on {getattr(func, '__name__', func)} for chat {chat_id}")
+                self._chat_bucket(chat_id).block(e.value)
+                await asyncio.sleep(e.value)
+                continue
+            self._chat_bucket(chat_id).success()
+            return result
+
+    async def edit(self, message, text: str, /, **kwargs):
+        """Edit a status message; edits queued behind a newer one are dropped.
+
+        Callers that get coalesced wait for the edit that carried their
+        (superseded) text, so ordering with later calls is preserved.
+        """
+        key = (message.chat.id, message.id)
+        if self.last_text.get(key) == text and key not in self.pending_edits:
+            return message
+
+        pending = self.pending_edits.get(key)
+        if pending is not None:
+            pending.text, pending.kwargs = text, kwargs
+            return await asyncio.shield(pending.done)
+
+        pending = self.pending_edits[key] = _PendingEdit(text, kwargs)
+        try:
+            await self._acquire(message.chat.id)
+            # Anything that arrived while we waited for a token replaces our text
+            del self.pending_edits[key]
+            result = message
+            if not pending.cancelled and self.last_text.get(key) != pending.text:
+                try:
+                    result = await self._invoke(
+                        message.chat.id, message.edit_text, (pending.text,), pending.kwargs, acquired=True
+                    )
+                except MessageNotModified:
+                    pass
+                self._remember(key, pending.text)
+            pending.done.set_result(result)
+            return result
+        except BaseException as e:
+            self.pending_edits.pop(key, None)
+            if not pending.done.done():
+                if isinstance(e, asyncio.CancelledError):
+                    pending.done.cancel()
+                else:
+                    pending.done.set_exception(e)
+                    pending.done.exception()  # Mark retrieved when nobody is waiting
+            raise
+
+    async def delete(self, message, /, *args, **kwargs):
+        """Delete a message, dropping any edit still queued for it"""
+        key = (message.chat.id, message.id)
+        pending = self.pending_edits.get(key)
+        if pending is not None:
+            pending.cancelled = True
+        self.last_text.pop(key, None)
+        return await self.call(message.chat.id, message.delete, *args, **kwargs)
+
+    def detach(self, coro: Awaitable):
+        """Run a non-critical call (status edit, cleanup delete) without waiting for its token"""
+        task = asyncio.ensure_future(coro)
+        self._detached.add(task)
+        task.add_done_callback(self._detached_done)
+        return task
+
+    def _detached_done(self, task: asyncio.Task):
+        self._detached.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f"Detached Telegram call failed: {task.exception()}")
+
+    def _remember(self, key: Tuple[int, int], text: str):
+        self.last_text[key] = text
+        self.last_text.move_to_end(key)
+        if len(self.last_text) > MAX_CHAT_BUCKETS:
+            self.last_text.popitem(last=False)
+
+
+limiter = OutboundLimiter()
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import subprocess
+from typing import Dict, List, Optional, Set
+
+from config import SHUTDOWN
+from helpers.checkpoint import sweep_workspaces
+from helpers.ratelimit import limiter
+
+log = logging.getLogger(__name__)
+
+RESTARTING_TEXT = "🔄 Bot is restarting, please send the command again in a minute."
+INTERRUPTED_TEXT = "🔄 Bot is restarting. Your job was saved and will resume automatically."
+
+
+class ShutdownCoordinator:
+    """Drains the process on stop: refuse new jobs, let running ones finish, then clean up"""
+
+    def __init__(self):
+        self.accepting = True
+        self.processes: Set[asyncio.subprocess.Process] = set()
+
+    async def run(self, cmd: List[str]):
+        """Run a child process (ffmpeg, pdftk) that dies with its job instead of being orphaned.
+
+        Raises ``subprocess.CalledProcessError`` on a non-zero exit, like
+        ``subprocess.run(cmd, check=True)``, without blocking the event loop.
+        """
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL)
+        self.processes.add(proc)
+        try:
+            await proc.wait()
+        except asyncio.CancelledError:
+            await self._terminate(proc)
+            raise
+        finally:
+            self.processes.discard(proc)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    async def _terminate(self, proc: asyncio.subprocess.Process):
+        if proc.returncode is not None:
+            return
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), SHUTDOWN.KILL_GRACE)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+    async def kill_children(self):
+        if self.processes:
+            log.warning(f"Killing {len(self.processes)} leftover child process(es)")
+            await asyncio.gather(*(self._terminate(p) for p in list(self.processes)), return_exceptions=True)
+
+    async def shutdown(self, client, worker=None, workspaces: Optional[str] = None,
+                       timeout: Optional[float] = None):
+        """Stop taking jobs and drain `worker` within `timeout` seconds.
+
+        Jobs still running at the deadline are cancelled and handed back to
+        the queue with their checkpoints, and their users are told they will
+        resume. Workspaces of jobs that are no longer live are removed.
+        """
+        if not self.accepting:
+            return
+        self.accepting = False
+        timeout = SHUTDOWN.DRAIN_TIMEOUT if timeout is None else timeout
+
+        interrupted: List[Dict] = []
+        if worker is not None:
+            if worker.tasks:
+                log.info(f"Draining {len(worker.tasks)} running job(s) for up to {timeout:g}s")
+            interrupted = await worker.stop(timeout)
+        await self.kill_children()
+
+        for job in interrupted:
+            log.warning(f"Job {job['_id']} ({job['kind']}) interrupted by shutdown, requeued")
+            try:
+                await limiter.call(
+                    job["chat_id"], client.edit_message_text,
+                    job["chat_id"], job["payload"]["status_id"], INTERRUPTED_TEXT
+                )
+            except Exception as e:
+                log.warning(f"Could not notify chat {job['chat_id']} about job {job['_id']}: {e}")
+
+        if worker is not None and workspaces:
+            try:
+                await sweep_workspaces(worker.db, workspaces)
+            except Exception as e:
+                log.error(f"Workspace cleanup error: {e}")
+
+
+coordinator = ShutdownCoordinator()
+run_command = coordinator.run
@@ -0,0 +1,259 @@
+import asyncio
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import CACHE
+from helpers import transfer
+
+log = logging.getLogger(__name__)
+
+# Held (flock) by the process using a cache directory, so others can tell it is live
+LOCK_NAME = ".lock"
+# Partial download and its part log, next to the entry they become
+PARTIAL_SUFFIXES = (".temp", ".parts")
+
+
+class PartsFile(transfer.ResumeLog):
+    """Finished parts of a partial ``<key>.temp`` in the cache, stored beside it as ``<key>.parts``.
+
+    Whichever job restarts an interrupted download continues it from this
+    log; a job's own checkpoint can't be trusted for a file other jobs write.
+    """
+
+    def __init__(self, path: str):
+        parts = []
+        try:
+            with open(path) as f:
+                parts = [int(part) for part in f.read().split()]
+        except (FileNotFoundError, ValueError):
+            pass
+        super().__init__(parts)
+        self.path = path
+
+    async def part_done(self, part: int):
+        await super().part_done(part)
+        await self.flush()
+
+    async def flush(self):
+        # Written after the part itself, so the log never lists bytes that aren't on disk
+        with open(self.path + ".new", "w") as f:
+            f.write(" ".join(map(str, sorted(self.parts))))
+        os.replace(self.path + ".new", self.path)
+
+    def remove(self):
+        for path in (self.path, self.path + ".new"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class _Flight:
+    """One download shared by every job that asked for the same file meanwhile"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SourceCache:
+    """Downloaded source files shared between jobs, keyed by ``file_unique_id``.
+
+    Jobs get a hardlink to the cached file in their workspace (a copy where
+    links aren't possible), so the file's link count is its reference count:
+    an entry is only evicted, oldest use first, once no workspace links it
+    and the cache is over its byte budget. Linked files are shared and must
+    never be modified in place.
+    """
+
+    def __init__(self, root: str, budget: int = CACHE.SOURCE_BYTES):
+        self.root = root
+        self.budget = budget
+        # file_unique_id -> size, least recently used first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.flights: Dict[str, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock: Optional[int] = None
+
+    def open(self, root: Optional[str] = None):
+        """Lock `root`, adopt finished files left by a previous run and drop stale partial ones"""
+        if root:
+            self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = os.open(os.path.join(self.root, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"Source cache {self.root} is used by another process; is WORKER_NAME unique?")
+        files = sorted(os.scandir(self.root), key=lambda e: e.stat().st_mtime)
+        for entry in files:
+            if entry.name != LOCK_NAME and not entry.name.endswith(PARTIAL_SUFFIXES) and entry.is_file():
+                self.entries[entry.name] = entry.stat().st_size
+        self.trim()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    @property
+    def size(self) -> int:
+        return sum(self.entries.values())
+
+    def _link(self, key: str, file_name: str) -> Optional[str]:
+        """Hardlink a cached file to `file_name`; None if it is not (or no longer) cached"""
+        if key not in self.entries:
+            return None
+        source = self._path(key)
+        if os.path.lexists(file_name):
+            os.remove(file_name)
+        try:
+            os.link(source, file_name)
+        except FileNotFoundError:
+            self.entries.pop(key, None)
+            return None
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            shutil.copyfile(source, file_name)
+        self.entries.move_to_end(key)
+        return os.path.abspath(file_name)
+
+    def link_cached(self, message, file_name: str) -> Optional[str]:
+        """Put the message's media at `file_name` if it is already cached, without downloading"""
+        media = transfer.get_media(message)
+        key = getattr(media, "file_unique_id", None)
+        path = self._link(key, file_name) if key else None
+        if path:
+            self.hits += 1
+        return path
+
+    async def fetch(self, client, message, file_name: str, resume: Optional[transfer.ResumeLog] = None) -> str:
+        """Put the message's media at `file_name`, downloading it at most once for all jobs.
+
+        Concurrent callers for the same file share one in-flight download;
+        it is cancelled only when every one of them has gone, and the next
+        download of that file continues from its `PartsFile`. `resume` is
+        only used for media without a ``file_unique_id``, which bypasses the cache.
+        """
+        media = transfer.get_media(message)
+        key = getattr(media, "file_unique_id", None)
+        if not key:
+            return await transfer.download_media(client, message, file_name=file_name, resume=resume)
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        if os.path.exists(file_name) and os.path.getsize(file_name) == media.file_size:
+            # Linked by an earlier attempt of this job
+            return os.path.abspath(file_name)
+
+        while True:
+            path = self._link(key, file_name)
+            if path:
+                self.hits += 1
+                return path
+            flight = self.flights.get(key)
+            if flight is None:
+                self.misses += 1
+                os.makedirs(self.root, exist_ok=True)
+                flight = self.flights[key] = _Flight(
+                    asyncio.ensure_future(self._download(key, client, message))
+                )
+            else:
+                self.hits += 1
+            flight.waiters += 1
+            try:
+                await asyncio.shield(flight.task)
+                # The flight stays registered until its waiters have linked, so it can't be evicted first
+                path = self._link(key, file_name)
+            finally:
+                flight.waiters -= 1
+                if not flight.waiters:
+                    if not flight.task.done():
+                        flight.task.cancel()
+                    if self.flights.get(key) is flight:
+                        del self.flights[key]
+            if path:
+                self.trim()
+                return path
+
+    async def _download(self, key: str, client, message):
+        path = self._path(key)
+        parts = PartsFile(path + ".parts")
+        try:
+            path = await transfer.download_media(client, message, file_name=path, resume=parts)
+        except asyncio.CancelledError:
+            # Interrupted: the partial file and its log stay for the next job to resume
+            raise
+        except Exception:
+            # Failed for good; the partial file isn't in the byte budget, so don't keep it
+            try:
+                os.remove(path + ".temp")
+            except FileNotFoundError:
+                pass
+            parts.remove()
+            raise
+        parts.remove()
+        self.entries[key] = os.path.getsize(path)
+
+    def _drop_stale_partials(self):
+        """Delete partial downloads that no retried job came back for"""
+        stale = time.time() - CACHE.STALE_TEMP_SECONDS
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not entry.name.endswith(PARTIAL_SUFFIXES) or entry.name.rsplit(".", 1)[0] in self.flights:
+                continue
+            try:
+                if entry.stat().st_mtime < stale:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def trim(self):
+        """Evict least recently used entries no workspace links until the cache fits its budget"""
+        self._drop_stale_partials()
+        total = self.size
+        for key in list(self.entries):
+            if total <= self.budget:
+                break
+            if key in self.flights:
+                continue
+            path = self._path(key)
+            try:
+                if os.stat(path).st_nlink > 1:
+                    continue  # Still linked into a job workspace
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= self.entries.pop(key)
+            log.info(f"Evicted {key} from the source cache")
+
+
+def sweep_orphans(parent: str, prefix: str = "source_cache"):
+    """Delete cache directories under `parent` that no running process holds open"""
+    if not os.path.isdir(parent):
+        return
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if not name.startswith(prefix) or not os.path.isdir(path):
+            continue
+        try:
+            fd = os.open(os.path.join(path, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            continue
+        try:
+            # Our own cache is locked through another descriptor, so it is skipped too
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            continue
+        else:
+            log.info(f"Removing orphaned source cache {name}")
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            os.close(fd)
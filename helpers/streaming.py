@@ -0,0 +1,194 @@
+import asyncio
+import errno
+import logging
+import os
+import struct
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from config import COMBINE
+from helpers.mp4 import FASTSTART_FLAGS
+from helpers.shutdown import run_command
+from helpers.transfer import TransferError, get_media
+
+log = logging.getLogger(__name__)
+
+# Formats ffmpeg can demux from a pipe (MP4 only when moov precedes mdat)
+STREAMABLE_TYPES = (".mp4", ".mp3")
+
+
+def moov_first(head: bytes) -> bool:
+    """True if the top-level MP4 boxes in `head` reach moov before mdat"""
+    pos = 0
+    while pos + 8 <= len(head):
+        size, kind = struct.unpack(">I4s", head[pos:pos + 8])
+        if kind == b"moov":
+            return True
+        if kind == b"mdat":
+            return False
+        if size == 1:
+            if pos + 16 > len(head):
+                return False
+            size = struct.unpack(">Q", head[pos + 8:pos + 16])[0]
+        if size < 8:
+            # 0 means "to end of file"; either way there is no moov ahead
+            return False
+        pos += size
+    return False
+
+
+async def _first_chunk(client, message) -> bytes:
+    async for chunk in client.stream_media(message, limit=1):
+        return chunk
+    return b""
+
+
+async def _produce(client, message, head: Optional[bytes], queue: asyncio.Queue,
+                   previous: Optional[asyncio.Event], downloaded: asyncio.Event):
+    """Stream one input into `queue`, starting once the input before it is fully downloaded"""
+    if previous is not None:
+        await previous.wait()
+    received = 0
+    try:
+        offset = 0
+        if head is not None:
+            await queue.put(head)
+            received, offset = len(head), 1
+        async for chunk in client.stream_media(message, offset=offset):
+            await queue.put(chunk)
+            received += len(chunk)
+    finally:
+        downloaded.set()
+    expected = get_media(message).file_size
+    if expected and received != expected:
+        raise TransferError(f"Stream stopped at {received} of {expected} bytes")
+    await queue.put(None)
+
+
+async def _open_fifo(path: str) -> int:
+    """Open a FIFO for writing once ffmpeg opens its read end, without parking a thread"""
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            await asyncio.sleep(0.05)
+            continue
+        os.set_blocking(fd, True)
+        return fd
+
+
+def _write_all(fd: int, chunk: bytes):
+    view = memoryview(chunk)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+async def _feed(path: str, queue: asyncio.Queue):
+    fd = await _open_fifo(path)
+    loop = asyncio.get_running_loop()
+    write = None
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+            # Blocks while ffmpeg is behind, which is what throttles the download.
+            # Shielded: cancelling can't stop the thread, only hide that it still runs
+            write = loop.run_in_executor(None, _write_all, fd, chunk)
+            await asyncio.shield(write)
+    finally:
+        if write is not None and not write.done():
+            # Don't close fd under a write still in progress (its number could be reused);
+            # a cancelled combine kills ffmpeg, so the write ends with EPIPE
+            await asyncio.wait([write])
+        if write is not None and not write.cancelled():
+            write.exception()
+        os.close(fd)
+
+
+async def stream_combine(client, messages: List, output_path: str, file_type: str, workspace: str,
+                         download: Callable[[int, object], Awaitable[str]],
+                         cached: Optional[Callable[[int, object], Optional[str]]] = None,
+                         disk_limit: Optional[int] = None):
+    """Concatenate the media of `messages` with ffmpeg while it downloads.
+
+    Each input is streamed from Telegram into its own named FIFO, which
+    ffmpeg's concat demuxer opens in order, so merging starts with the first
+    bytes and only the output is written to disk. MP4 inputs whose moov atom
+    sits after the media data can't be read from a pipe; those are fetched
+    with `download(index, message)` first and read from disk, as are
+    inputs for which `cached(index, message)` returns a local path.
+    Raises ``ValueError`` before downloading anything if the inputs that
+    must go to disk exceed `disk_limit` bytes, and
+    ``subprocess.CalledProcessError`` if ffmpeg fails.
+    """
+    local: Dict[int, str] = {}
+    if cached is not None:
+        for i, message in enumerate(messages):
+            path = cached(i, message)
+            if path:
+                local[i] = path
+
+    heads: List[Optional[bytes]] = [None] * len(messages)
+    if file_type == ".mp4":
+        pending = [i for i in range(len(messages)) if i not in local]
+        for i, head in zip(pending, await asyncio.gather(*(_first_chunk(client, messages[i]) for i in pending))):
+            heads[i] = head
+
+    on_disk = sum(get_media(messages[i]).file_size for i, head in enumerate(heads)
+                  if head is not None and not moov_first(head))
+    if disk_limit is not None and on_disk > disk_limit:
+        raise ValueError(
+            f"MP4 files that aren't fast-start must be downloaded first and total {on_disk // (1024 * 1024)}MB, "
+            f"over the {disk_limit // (1024 * 1024)}MB limit for those"
+        )
+
+    sources: List[str] = []
+    fifos: Dict[int, str] = {}
+    try:
+        for i, message in enumerate(messages):
+            if i in local:
+                sources.append(os.path.abspath(local[i]))
+                continue
+            if heads[i] is not None and not moov_first(heads[i]):
+                log.info(f"Input {i} of {output_path} is not fast-start, downloading it first")
+                sources.append(os.path.abspath(await download(i, message)))
+                continue
+            path = os.path.join(workspace, f"stream_{i}{file_type}")
+            if os.path.lexists(path):
+                os.remove(path)
+            os.mkfifo(path)
+            fifos[i] = path
+            sources.append(os.path.abspath(path))
+
+        list_path = f"{output_path}.txt"
+        with open(list_path, "w") as f:
+            for source in sources:
+                f.write(f"file '{source}'\n")
+
+        cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if file_type == ".mp4":
+            cmd.extend(['-c', 'copy', *FASTSTART_FLAGS])
+        cmd.append(output_path)
+
+        tasks = [asyncio.ensure_future(run_command(cmd))]
+        previous = None
+        for i, path in fifos.items():
+            queue = asyncio.Queue(COMBINE.READAHEAD)
+            downloaded = asyncio.Event()
+            tasks.append(asyncio.ensure_future(_produce(client, messages[i], heads[i], queue, previous, downloaded)))
+            tasks.append(asyncio.ensure_future(_feed(path, queue)))
+            previous = downloaded
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # A failed download or ffmpeg exit takes the rest down (cancelling kills ffmpeg)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        os.remove(list_path)
+    finally:
+        for path in fifos.values():
+            if os.path.lexists(path):
+                os.remove(path)
@@ -0,0 +1,167 @@
+import asyncio
+import contextvars
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import TRACE
+
+log = logging.getLogger(__name__)
+
+# Trace of the job running in the current task; Worker sets it before starting a runner
+current_trace: contextvars.ContextVar[Optional["JobTrace"]] = contextvars.ContextVar("current_trace", default=None)
+
+
+class JobTrace:
+    """Wall-clock time one job spent in each stage (download, ffmpeg, upload, mongo, ...)"""
+
+    def __init__(self, job: Dict):
+        self.job_id = str(job["_id"])
+        self.kind = job["kind"]
+        self.user_id = job.get("user_id")
+        self.attempt = job.get("attempts", 1)
+        self.started_at = datetime.utcnow()
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.status = "running"
+        # Repeated stages (one download per combine input) add up under one name
+        self.spans: Dict[str, float] = {}
+        self.stage = "starting"
+
+    @property
+    def elapsed(self) -> float:
+        return self.duration or time.monotonic() - self.started
+
+    @contextmanager
+    def span(self, name: str):
+        previous, self.stage = self.stage, name
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.monotonic() - start
+            self.stage = previous
+
+    def breakdown(self) -> str:
+        return breakdown(self.spans, self.elapsed)
+
+    def to_doc(self) -> Dict:
+        """Summary stored on the job document, so /perf sees jobs of every worker"""
+        return {
+            "status": self.status,
+            "attempt": self.attempt,
+            "started_at": self.started_at,
+            "duration": round(self.duration, 3),
+            "spans": {name: round(seconds, 3) for name, seconds in self.spans.items()},
+        }
+
+
+def breakdown(spans: Dict[str, float], elapsed: float) -> str:
+    """``download 3.1s, upload 1.2s, other 0.4s`` from a span dict"""
+    parts = [f"{name} {seconds:.1f}s" for name, seconds in spans.items()]
+    other = elapsed - sum(spans.values())
+    if other >= 0.1:
+        parts.append(f"other {other:.1f}s")
+    return ", ".join(parts) or "no spans"
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the current job; a no-op outside of a traced job"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+class Tracer:
+    """Jobs running in this process and its event-loop lag; finished traces go to Mongo via Worker"""
+
+    def __init__(self):
+        self.inflight: Dict[str, JobTrace] = {}
+        self.finished = Counter()
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self._monitor: Optional[asyncio.Task] = None
+
+    def begin(self, job: Dict) -> JobTrace:
+        trace = JobTrace(job)
+        self.inflight[trace.job_id] = trace
+        return trace
+
+    def end(self, trace: JobTrace, status: str):
+        trace.duration = time.monotonic() - trace.started
+        trace.status = status
+        self.inflight.pop(trace.job_id, None)
+        self.finished[status] += 1
+        if trace.duration >= TRACE.SLOW_SECONDS:
+            log.info(f"Slow {trace.kind} job {trace.job_id}: {trace.duration:.1f}s ({trace.breakdown()})")
+
+    def stages(self) -> Counter:
+        """How many running jobs are in each stage right now"""
+        return Counter(trace.stage for trace in self.inflight.values())
+
+    def start_monitor(self):
+        if self._monitor is None:
+            self._monitor = asyncio.ensure_future(self._watch_loop())
+
+    async def _watch_loop(self):
+        interval = TRACE.LOOP_LAG_INTERVAL
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            # Anything past the requested sleep was spent waiting for the loop
+            self.loop_lag = max(0.0, time.monotonic() - start - interval)
+            self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread and counts them in collapsed-stack format.
+
+    The output (``thread;outer;...;inner count`` per line) loads straight
+    into flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, interval: float = TRACE.PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.total = 0
+
+    def _sample(self, own_ident: int):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.samples[";".join(reversed(stack))] += 1
+        self.total += 1
+
+    def _run(self, seconds: float):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self._sample(own_ident)
+            time.sleep(self.interval)
+
+    async def profile(self, seconds: float) -> str:
+        """Sample for `seconds` in a helper thread and return the collapsed stacks"""
+        thread = threading.Thread(target=self._run, args=(seconds,), name="profiler", daemon=True)
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.2)
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+tracer = Tracer()
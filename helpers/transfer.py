@@ -0,0 +1,354 @@
+import asyncio
+import inspect
+import logging
+import math
+import os
+import random
+import weakref
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from pyrogram import Client, raw
+from pyrogram.errors import AuthBytesInvalid, FloodWait, InternalServerError, ServiceUnavailable
+from pyrogram.file_id import FileId
+from pyrogram.session import Auth, Session
+
+from config import TRANSFER
+
+log = logging.getLogger(__name__)
+
+DOWNLOAD_PART_SIZE = 1024 * 1024  # upload.GetFile maximum
+UPLOAD_PART_SIZE = 512 * 1024  # upload.SaveBigFilePart maximum
+BIG_FILE_SIZE = 10 * 1024 * 1024  # Telegram requires the big-file API above this
+
+# client -> dc_id -> sessions, so pools die with their client
+_pools: "weakref.WeakKeyDictionary[Client, Dict[int, List[Session]]]" = weakref.WeakKeyDictionary()
+_pool_lock = asyncio.Lock()
+
+
+class TransferError(Exception):
+    pass
+
+
+def get_media(message):
+    """Return the downloadable media attribute of a message"""
+    for attr in ("document", "video", "audio", "voice", "animation", "video_note", "photo"):
+        media = getattr(message, attr, None)
+        if media:
+            return media
+    return None
+
+
+def use_parallel(client, size: int) -> bool:
+    """Parallel parts only pay off on real sessions and large files"""
+    return (
+        isinstance(client, Client)
+        and TRANSFER.PARALLEL > 1
+        and size >= max(TRANSFER.PARALLEL_THRESHOLD, BIG_FILE_SIZE + 1)
+    )
+
+
+async def _report(progress: Callable, *args):
+    """Call a Pyrogram-style progress callback, sync or async"""
+    if inspect.iscoroutinefunction(progress):
+        await progress(*args)
+    else:
+        progress(*args)
+
+
+# ------------------ Sessions ------------------
+async def _media_sessions(client: Client, dc_id: int) -> List[Session]:
+    """Get (or open) a pool of media sessions to `dc_id`"""
+    async with _pool_lock:
+        pools = _pools.setdefault(client, {})
+        if dc_id in pools:
+            return pools[dc_id]
+
+        test_mode = await client.storage.test_mode()
+        home_dc = await client.storage.dc_id()
+        if dc_id == home_dc:
+            auth_key = await client.storage.auth_key()
+        else:
+            auth_key = await Auth(client, dc_id, test_mode).create()
+
+        sessions = [Session(client, dc_id, auth_key, test_mode, is_media=True) for _ in range(TRANSFER.SESSIONS)]
+        for session in sessions:
+            await session.start()
+
+        if dc_id != home_dc:
+            # Sessions share one auth key, so a single import authorizes the pool
+            for _ in range(3):
+                exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                try:
+                    await sessions[0].invoke(
+                        raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes)
+                    )
+                except AuthBytesInvalid:
+                    continue
+                break
+            else:
+                for session in sessions:
+                    await session.stop()
+                raise AuthBytesInvalid
+
+        pools[dc_id] = sessions
+        return sessions
+
+
+async def close_sessions(client: Client):
+    """Stop every pooled transfer session of `client`"""
+    async with _pool_lock:
+        pools = _pools.pop(client, {})
+    for sessions in pools.values():
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception as e:
+                log.warning(f"Transfer session stop error: {e}")
+
+
+async def _invoke_part(session: Session, query, what: str):
+    """Invoke one part request with FloodWait handling and bounded retries"""
+    for attempt in range(TRANSFER.RETRIES + 1):
+        try:
+            return await session.invoke(query, retries=0)
+        except FloodWait as e:
+            await asyncio.sleep(e.value + 1)
+        # retries=0 leaves Telegram's transient 500/503 answers to us as well
+        except (OSError, asyncio.TimeoutError, ConnectionError, InternalServerError, ServiceUnavailable) as e:
+            if attempt == TRANSFER.RETRIES:
+                raise TransferError(f"{what} failed after {attempt + 1} attempts: {e}") from e
+            await asyncio.sleep(min(2 ** attempt, 30) * (0.5 + random.random()))
+    raise TransferError(f"{what} failed: too many FloodWaits")
+
+
+async def _run_parts(parts: Iterable[int], sessions: List[Session], handle: Callable):
+    """Process part indexes with TRANSFER.PARALLEL workers spread over `sessions`"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for part in parts:
+        queue.put_nowait(part)
+    total = queue.qsize()
+
+    async def worker(session: Session):
+        while True:
+            try:
+                part = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await handle(session, part)
+
+    workers = [
+        asyncio.ensure_future(worker(sessions[i % len(sessions)]))
+        for i in range(min(TRANSFER.PARALLEL, total))
+    ]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+
+# ------------------ Download ------------------
+class ResumeLog:
+    """Completed download part indexes of one file, persisted by a subclass.
+
+    Parts are ``DOWNLOAD_PART_SIZE`` bytes. ``part_done`` is called after a
+    part has been written and ``flush`` when the download stops for any reason.
+    """
+
+    def __init__(self, parts: Iterable[int] = ()):
+        self.parts: Set[int] = set(parts)
+
+    def reset(self):
+        self.parts.clear()
+
+    async def part_done(self, part: int):
+        self.parts.add(part)
+
+    async def flush(self):
+        pass
+
+
+def _prepare_temp(temp_path: str, resume: Optional[ResumeLog]) -> int:
+    """Open the partial download, starting over unless `resume` matches what is on disk"""
+    if resume is not None and os.path.exists(temp_path):
+        # A file that doesn't reach the last logged part was cut short after the log was written
+        if not resume.parts or os.path.getsize(temp_path) > max(resume.parts) * DOWNLOAD_PART_SIZE:
+            return os.open(temp_path, os.O_RDWR)
+    if resume is not None:
+        resume.reset()
+    return os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+
+
+async def _parallel_download(client: Client, media, file_name: str, progress: Optional[Callable],
+                             resume: Optional[ResumeLog]) -> str:
+    file_id = FileId.decode(media.file_id)
+    location = raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=file_id.thumbnail_size,
+    )
+    size = media.file_size
+    total = math.ceil(size / DOWNLOAD_PART_SIZE)
+    sessions = await _media_sessions(client, file_id.dc_id)
+
+    temp_path = file_name + ".temp"
+    fd = _prepare_temp(temp_path, resume)
+    skip = {p for p in resume.parts if p < total} if resume else set()
+    done = sum(min(DOWNLOAD_PART_SIZE, size - p * DOWNLOAD_PART_SIZE) for p in skip)
+    try:
+        # Reserve the whole file up front; parts land at their offsets
+        if os.fstat(fd).st_size != size:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+
+        async def fetch(session: Session, part: int):
+            nonlocal done
+            offset = part * DOWNLOAD_PART_SIZE
+            r = await _invoke_part(
+                session,
+                raw.functions.upload.GetFile(location=location, offset=offset, limit=DOWNLOAD_PART_SIZE),
+                f"Download part {part}/{total}",
+            )
+            if not isinstance(r, raw.types.upload.File):
+                raise TransferError("CDN redirect")
+            expected = min(DOWNLOAD_PART_SIZE, size - offset)
+            if len(r.bytes) != expected:
+                raise TransferError(f"Download part {part} returned {len(r.bytes)} of {expected} bytes")
+            os.pwrite(fd, r.bytes, offset)
+            done += len(r.bytes)
+            if resume:
+                await resume.part_done(part)
+            if progress:
+                await _report(progress, done, size)
+
+        await _run_parts((p for p in range(total) if p not in skip), sessions, fetch)
+    except BaseException:
+        os.close(fd)
+        if resume:
+            # Keep the partial file; the parts already written are in the log
+            await resume.flush()
+        else:
+            os.remove(temp_path)
+        raise
+    os.close(fd)
+    os.replace(temp_path, file_name)
+    if resume:
+        await resume.flush()
+    return os.path.abspath(file_name)
+
+
+async def _stream_download(client, message, media, file_name: str, progress: Optional[Callable],
+                           resume: ResumeLog) -> str:
+    """Sequential download through ``client.stream_media`` that continues after the last logged part"""
+    size = media.file_size
+    temp_path = file_name + ".temp"
+    fd = _prepare_temp(temp_path, resume)
+    start = 0
+    while start in resume.parts:
+        start += 1
+    # Anything past the contiguous prefix may be a torn write; fetch it again
+    resume.parts = set(range(start))
+    os.ftruncate(fd, start * DOWNLOAD_PART_SIZE)
+    done = start * DOWNLOAD_PART_SIZE
+    part = start
+    try:
+        async for chunk in client.stream_media(message, offset=start):
+            os.pwrite(fd, chunk, part * DOWNLOAD_PART_SIZE)
+            done += len(chunk)
+            await resume.part_done(part)
+            part += 1
+            if progress:
+                await _report(progress, done, size)
+    finally:
+        os.close(fd)
+        await resume.flush()
+    if size and done != size:
+        raise TransferError(f"Download stopped at {done} of {size} bytes")
+    os.replace(temp_path, file_name)
+    return os.path.abspath(file_name)
+
+
+async def download_media(client, message, file_name: str = "", progress: Optional[Callable] = None,
+                         resume: Optional[ResumeLog] = None) -> str:
+    """Download a message's media, in parallel parts when it is large enough.
+
+    Small files, photos and clients without raw sessions use
+    ``client.download_media``. `progress` is a Pyrogram-style (current, total) callback.
+    With `resume`, a partial ``<file_name>.temp`` left by an earlier attempt is
+    continued from the parts recorded in the log, and a finished `file_name`
+    is returned as is.
+    """
+    media = get_media(message)
+    if resume is not None and media is not None and file_name and not file_name.endswith(os.sep):
+        if os.path.exists(file_name) and os.path.getsize(file_name) == media.file_size:
+            return os.path.abspath(file_name)
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    else:
+        resume = None
+
+    if media is None or getattr(message, "photo", None) or not use_parallel(client, media.file_size or 0):
+        if resume is not None:
+            return await _stream_download(client, message, media, file_name, progress, resume)
+        return await client.download_media(message, file_name=file_name or "downloads/", progress=progress)
+
+    if not file_name or file_name.endswith(os.sep):
+        file_name = os.path.join(file_name or "downloads", getattr(media, "file_name", None) or media.file_unique_id)
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    try:
+        return await _parallel_download(client, media, file_name, progress, resume)
+    except TransferError as e:
+        log.warning(f"Parallel download failed ({e}), falling back to single stream")
+        if resume is not None:
+            return await _stream_download(client, message, media, file_name, progress, resume)
+        return await client.download_media(message, file_name=file_name, progress=progress)
+
+
+# ------------------ Upload ------------------
+async def upload_file(client: Client, path: str, progress: Optional[Callable] = None, progress_args: tuple = ()):
+    """Upload a local file as concurrent big-file parts and return its ``InputFileBig``"""
+    size = os.path.getsize(path)
+    total = math.ceil(size / UPLOAD_PART_SIZE)
+    file_id = client.rnd_id()
+    sessions = await _media_sessions(client, await client.storage.dc_id())
+    done = 0
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        async def send(session: Session, part: int):
+            nonlocal done
+            chunk = os.pread(fd, UPLOAD_PART_SIZE, part * UPLOAD_PART_SIZE)
+            ok = await _invoke_part(
+                session,
+                raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=part, file_total_parts=total, bytes=chunk
+                ),
+                f"Upload part {part}/{total}",
+            )
+            if not ok:
+                raise TransferError(f"Upload part {part} was rejected")
+            done += len(chunk)
+            if progress:
+                await _report(progress, done, size, *progress_args)
+
+        await _run_parts(range(total), sessions, send)
+    finally:
+        os.close(fd)
+
+    return raw.types.InputFileBig(id=file_id, parts=total, name=os.path.basename(path))
+
+
+class ParallelUploadMixin:
+    """Client mixin sending large on-disk uploads through ``upload_file``"""
+
+    async def save_file(self, path, file_id=None, file_part=0, progress=None, progress_args=()):
+        if isinstance(path, str) and file_id is None and use_parallel(self, os.path.getsize(path)):
+            return await upload_file(self, path, progress, progress_args)
+        return await super().save_file(path, file_id, file_part, progress, progress_args)
+
+    async def stop(self, *args):
+        await close_sessions(self)
+        return await super().stop(*args)
@@ -0,0 +1,97 @@
+from collections import Counter
+from datetime import datetime
+from io import BytesIO
+
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from config import OWNER, TRACE
+from helpers.jobqueue import JobQueue
+from helpers.ratelimit import limiter
+from helpers.shutdown import coordinator
+from helpers.tracing import SamplingProfiler, breakdown, tracer
+from plugins.rename import db, source_cache
+
+_profiling = False
+
+
+async def perf_report(db) -> str:
+    """Loop lag and child processes of this process; jobs of every worker, from Mongo"""
+    queue = JobQueue(db)
+    now = datetime.utcnow()
+    running = await queue.running_jobs()
+    stages = Counter(job.get("stage") or "starting" for job in running)
+    stage_text = ", ".join(f"{stage} {count}" for stage, count in stages.most_common())
+    finished = ", ".join(f"{status} {count}" for status, count in tracer.finished.items()) or "none"
+    text = (
+        "📈 **Performance**\n\n"
+        f"🔹 Event loop lag: {tracer.loop_lag * 1000:.0f}ms (max {tracer.max_loop_lag * 1000:.0f}ms since last /perf)\n"
+        f"🔹 Jobs in flight (all workers): {len(running)}{f' ({stage_text})' if stage_text else ''}\n"
+        f"🔹 Finished jobs here: {finished}\n"
+        f"🔹 Child processes: {len(coordinator.processes)}\n"
+        f"🔹 Source cache: {len(source_cache.entries)} files, {source_cache.size // (1024 * 1024)}MB, "
+        f"{source_cache.hits} hits / {source_cache.misses} downloads\n"
+        f"🔹 Pending status edits: {len(limiter.pending_edits)}, FloodWaits: {limiter.flood_waits}\n"
+    )
+
+    running.sort(key=lambda job: job.get("started_at") or now)
+    if running:
+        text += "\n⏳ **Running**\n"
+        for job in running[:5]:
+            elapsed = (now - job["started_at"]).total_seconds() if job.get("started_at") else 0
+            text += (
+                f"• {job['kind']} `{job['_id']}` {elapsed:.1f}s in {job.get('stage') or 'starting'} "
+                f"on {job.get('worker_id')}\n"
+            )
+
+    slow = await queue.slow_jobs(TRACE.SLOW_SECONDS, TRACE.SLOW_JOBS)
+    slow.sort(key=lambda job: job["trace"]["duration"], reverse=True)
+    text += f"\n🐢 **Slowest recent jobs** (≥{TRACE.SLOW_SECONDS:g}s)\n"
+    if not slow:
+        text += "None\n"
+    for job in slow[:10]:
+        trace = job["trace"]
+        text += (
+            f"• {job['kind']} `{job['_id']}` {trace['duration']:.1f}s, {trace['status']}, "
+            f"{trace['started_at']:%H:%M:%S} on {job.get('worker_id')}\n"
+            f"  {breakdown(trace['spans'], trace['duration'])}\n"
+        )
+    return text
+
+
+@Client.on_message(filters.command(["perf"]) & filters.user(OWNER.ID))
+async def perf_handler(client: Client, message: Message):
+    global _profiling
+    args = message.command[1:]
+
+    if not args:
+        text = await perf_report(db)
+        tracer.max_loop_lag = tracer.loop_lag
+        await limiter.call(message.chat.id, message.reply_text, text)
+        return
+
+    if args[0] != "profile":
+        await limiter.call(message.chat.id, message.reply_text, "Usage: /perf or /perf profile [seconds]")
+        return
+
+    if _profiling:
+        await limiter.call(message.chat.id, message.reply_text, "A profile is already being recorded.")
+        return
+    seconds = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+    seconds = max(1, min(seconds, TRACE.MAX_PROFILE_SECONDS))
+
+    _profiling = True
+    try:
+        status = await limiter.call(message.chat.id, message.reply_text, f"🔬 Profiling all threads for {seconds}s...")
+        profiler = SamplingProfiler()
+        stacks = await profiler.profile(seconds)
+    finally:
+        _profiling = False
+
+    profile = BytesIO(stacks.encode())
+    profile.name = f"profile_{datetime.utcnow():%Y%m%d_%H%M%S}.txt"
+    await limiter.call(
+        message.chat.id, message.reply_document, profile,
+        caption=f"🔬 {profiler.total} samples over {seconds}s (collapsed stacks for flamegraph.pl / speedscope)"
+    )
+    limiter.detach(limiter.delete(status))
@@ -1,17 +1,28 @@
 import os
 import re
+import shutil
 import asyncio
+import logging
+import subprocess
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
-import subprocess
 import ffmpeg
 from motor.motor_asyncio import AsyncIOMotorClient
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 from hachoir.parser import createParser
 from hachoir.metadata import extractMetadata
+from config import COMBINE
+from helpers import imaging, mp4, streaming, transfer
+from helpers.checkpoint import Checkpoint
+from helpers.jobqueue import JobQueue, job_runner
+from helpers.ratelimit import limiter
+from helpers.shutdown import RESTARTING_TEXT, coordinator, run_command
+from helpers.source_cache import SourceCache
+from helpers.tracing import span
+
+log = logging.getLogger(__name__)
 
 # MongoDB Configuration
 MN_DB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")  # Get from environment variable
@@ -21,9 +32,12 @@ db = client["rename_bot"]
 # Constants
 WATERMARK_FONT = "arial.ttf"  # Make sure this font file exists
 TEMP_DIR = "temp_files"
-MAX_COMBINE_SIZE = 500 * 1024 * 1024  # 500MB limit for combined files
+MAX_COMBINE_SIZE = 500 * 1024 * 1024  # 500MB limit for combined files staged on disk
 SUPPORTED_COMBINE_TYPES = [".mp4", ".mp3", ".pdf"]
 
+# Sources shared by jobs on this host; files in job workspaces are hardlinks into it
+source_cache = SourceCache(os.path.join(TEMP_DIR, "source_cache"))
+
 # Helper functions
 async def clean_filename(filename: str) -> str:
     """Remove invalid characters from filename"""
@@ -67,17 +81,15 @@ async def generate_thumbnail(file_path: str) -> Optional[BytesIO]:
     """Generate thumbnail from file"""
     try:
         if file_path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")):
-            with Image.open(file_path) as img:
-                img.thumbnail((320, 320))
-                thumb = BytesIO()
-                img.save(thumb, "JPEG")
-                thumb.name = "thumbnail.jpg"
-                thumb.seek(0)
-                return thumb
+            return await imaging.make_thumbnail(file_path)
     except Exception as e:
-        print(f"Thumbnail error: {e}")
+        log.warning(f"Thumbnail error: {e}")
     return None
 
+def faststart_flags(output_path: str) -> List[str]:
+    """Have ffmpeg put moov first so Telegram clients can play before the download ends"""
+    return mp4.FASTSTART_FLAGS if output_path.lower().endswith(mp4.MP4_EXTENSIONS) else []
+
 async def apply_watermark(input_path: str, output_path: str, settings: Dict) -> bool:
     """Apply watermark to file"""
     try:
@@ -85,34 +97,7 @@ async def apply_watermark(input_path: str, output_path: str, settings: Dict) ->
             return False
 
         if input_path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")):
-            with Image.open(input_path) as img:
-                draw = ImageDraw.Draw(img)
-                try:
-                    font = ImageFont.truetype(WATERMARK_FONT, settings["watermark_size"])
-                except:
-                    font = ImageFont.load_default()
-                
-                text = settings["watermark_text"]
-                text_width, text_height = draw.textsize(text, font)
-                width, height = img.size
-                position = settings["watermark_position"]
-                
-                positions = {
-                    "top-left": (10, 10),
-                    "top-right": (width - text_width - 10, 10),
-                    "bottom-left": (10, height - text_height - 10),
-                    "bottom-right": (width - text_width - 10, height - text_height - 10),
-                    "center": ((width - text_width) // 2, (height - text_height) // 2)
-                }
-                
-                x, y = positions.get(position, positions["bottom-right"])
-                overlay = Image.new('RGBA', img.size, (255,255,255,0))
-                draw_overlay = ImageDraw.Draw(overlay)
-                draw_overlay.text((x, y), text, font=font, 
-                                fill=(255,255,255,int(255 * settings["watermark_opacity"]/100)))
-                img = Image.alpha_composite(img.convert('RGBA'), overlay)
-                img.save(output_path)
-                return True
+            return await imaging.watermark_image(input_path, output_path, settings, WATERMARK_FONT)
                 
         elif input_path.lower().endswith((".mp4", ".mov", ".avi")):
             position_map = {
@@ -124,7 +109,7 @@ async def apply_watermark(input_path: str, output_path: str, settings: Dict) ->
             }
             
             cmd = [
-                'ffmpeg',
+                'ffmpeg', '-y',
                 '-i', input_path,
                 '-vf', f"drawtext=text='{settings['watermark_text']}':"
                       f"fontfile={WATERMARK_FONT}:"
@@ -132,19 +117,20 @@ async def apply_watermark(input_path: str, output_path: str, settings: Dict) ->
                       f"fontcolor=white@{settings['watermark_opacity']/100}:"
                       f"x={position_map[settings['watermark_position']]}",
                 '-codec:a', 'copy',
+                *faststart_flags(output_path),
                 output_path
             ]
-            subprocess.run(cmd, check=True)
+            await run_command(cmd)
             return True
     except Exception as e:
-        print(f"Watermark error: {e}")
+        log.warning(f"Watermark error: {e}")
     return False
 
 async def edit_metadata(input_path: str, output_path: str, settings: Dict) -> bool:
     """Edit file metadata"""
     try:
         if input_path.lower().endswith((".mp3", ".flac", ".wav", ".m4a")):
-            cmd = ['ffmpeg', '-i', input_path]
+            cmd = ['ffmpeg', '-y', '-i', input_path]
             
             if settings.get("metadata_title"):
                 cmd.extend(['-metadata', f"title={settings['metadata_title']}"])
@@ -153,21 +139,21 @@ async def edit_metadata(input_path: str, output_path: str, settings: Dict) -> bo
             if settings.get("metadata_album"):
                 cmd.extend(['-metadata', f"album={settings['metadata_album']}"])
             
-            cmd.extend(['-codec', 'copy', output_path])
-            subprocess.run(cmd, check=True)
+            cmd.extend(['-codec', 'copy', *faststart_flags(output_path), output_path])
+            await run_command(cmd)
             return True
             
         elif input_path.lower().endswith((".mp4", ".mov", ".avi")):
-            cmd = ['ffmpeg', '-i', input_path]
+            cmd = ['ffmpeg', '-y', '-i', input_path]
             
             if settings.get("metadata_title"):
                 cmd.extend(['-metadata', f"title={settings['metadata_title']}"])
             
-            cmd.extend(['-codec', 'copy', output_path])
-            subprocess.run(cmd, check=True)
+            cmd.extend(['-codec', 'copy', *faststart_flags(output_path), output_path])
+            await run_command(cmd)
             return True
     except Exception as e:
-        print(f"Metadata error: {e}")
+        log.warning(f"Metadata error: {e}")
     return False
 
 async def get_metadata(file_path: str) -> Dict:
@@ -188,7 +174,7 @@ async def get_metadata(file_path: str) -> Dict:
                     key, val = line.split(": ", 1)
                     metadata[key.lower()] = val.strip()
     except Exception as e:
-        print(f"Metadata extraction error: {e}")
+        log.warning(f"Metadata extraction error: {e}")
     return metadata
 
 async def combine_files(file_paths: List[str], output_path: str, file_type: str) -> bool:
@@ -196,29 +182,31 @@ async def combine_files(file_paths: List[str], output_path: str, file_type: str)
     try:
         if file_type == ".mp4":
             # Combine videos
-            with open("file_list.txt", "w") as f:
+            list_path = f"{output_path}.txt"
+            with open(list_path, "w") as f:
                 for file in file_paths:
-                    f.write(f"file '{file}'\n")
+                    f.write(f"file '{os.path.abspath(file)}'\n")
             
             cmd = [
-                'ffmpeg',
+                'ffmpeg', '-y',
                 '-f', 'concat',
                 '-safe', '0',
-                '-i', 'file_list.txt',
+                '-i', list_path,
                 '-c', 'copy',
+                *faststart_flags(output_path),
                 output_path
             ]
-            subprocess.run(cmd, check=True)
-            os.remove("file_list.txt")
+            await run_command(cmd)
+            os.remove(list_path)
             return True
             
         elif file_type == ".mp3":
             # Combine audio files
-            cmd = ['ffmpeg']
+            cmd = ['ffmpeg', '-y']
             for file in file_paths:
                 cmd.extend(['-i', file])
             cmd.extend(['-filter_complex', f'concat=n={len(file_paths)}:v=0:a=1', output_path])
-            subprocess.run(cmd, check=True)
+            await run_command(cmd)
             return True
             
         elif file_type == ".pdf":
@@ -226,113 +214,232 @@ async def combine_files(file_paths: List[str], output_path: str, file_type: str)
             cmd = ['pdftk']
             cmd.extend(file_paths)
             cmd.extend(['cat', 'output', output_path])
-            subprocess.run(cmd, check=True)
+            await run_command(cmd)
             return True
             
     except Exception as e:
-        print(f"Combine error: {e}")
+        log.warning(f"Combine error: {e}")
+    return False
+
+def streams_combine(file_type: str) -> bool:
+    return COMBINE.STREAMING and file_type in streaming.STREAMABLE_TYPES
+
+def combine_limit(file_type: str) -> int:
+    """Size cap for a merge; streamed merges don't stage their inputs on disk"""
+    return COMBINE.MAX_STREAM_SIZE if streams_combine(file_type) else MAX_COMBINE_SIZE
+
+def combine_limits_text() -> str:
+    """Size caps as shown in help texts, e.g. ``2000MB (PDF: 500MB)``"""
+    return f"{combine_limit('.mp4')//(1024*1024)}MB (PDF: {combine_limit('.pdf')//(1024*1024)}MB)"
+
+async def stream_combine_files(client: Client, file_msgs: List[Message], output_path: str, file_type: str,
+                               workspace: str, download) -> bool:
+    """Combine files while they download, piping them into ffmpeg"""
+    # Inputs another job already fetched are read from the source cache instead
+    def cached(i: int, file_msg: Message) -> Optional[str]:
+        return source_cache.link_cached(file_msg, os.path.join(workspace, f"combine_{i}{file_type}"))
+
+    try:
+        # Only the streamed inputs may go past the on-disk limit
+        await streaming.stream_combine(client, file_msgs, output_path, file_type, workspace, download, cached,
+                                       disk_limit=MAX_COMBINE_SIZE)
+        return True
+    except subprocess.CalledProcessError as e:
+        log.warning(f"Combine error: {e}")
     return False
 
+# Job helpers
+def file_ref(message: Message) -> Dict:
+    """Storable pointer to a message's media (Message objects can't go into Mongo)"""
+    media = transfer.get_media(message)
+    return {
+        "chat_id": message.chat.id,
+        "message_id": message.id,
+        "file_name": getattr(media, "file_name", None) or "",
+        "file_size": media.file_size or 0,
+        "file_unique_id": media.file_unique_id,
+    }
+
+def media_kind(message: Message) -> str:
+    for kind in ("document", "video", "audio"):
+        if getattr(message, kind, None):
+            return kind
+    return "document"
+
+def job_workspace(job: Dict) -> str:
+    """Per-job scratch directory, so concurrent jobs never share file names"""
+    path = os.path.join(TEMP_DIR, f"job_{job['_id']}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def remove_workspace(workspace: str):
+    """Delete a finished job's files; its cached sources become evictable"""
+    shutil.rmtree(workspace, ignore_errors=True)
+    source_cache.trim()
+
+async def get_source_messages(client: Client, refs: List[Dict]) -> List[Message]:
+    """Fetch the messages behind file refs, one call per chat"""
+    by_chat: Dict[int, List[int]] = {}
+    for ref in refs:
+        by_chat.setdefault(ref["chat_id"], []).append(ref["message_id"])
+    found = {}
+    for chat_id, ids in by_chat.items():
+        for msg in await client.get_messages(chat_id, ids):
+            if msg is not None and not getattr(msg, "empty", False):
+                found[(chat_id, msg.id)] = msg
+    missing = [r for r in refs if (r["chat_id"], r["message_id"]) not in found]
+    if missing:
+        raise ValueError(f"{len(missing)} source message(s) were deleted")
+    return [found[(r["chat_id"], r["message_id"])] for r in refs]
+
+async def get_status_message(client: Client, job: Dict) -> Message:
+    """The job's "Queued" message, or a fresh one if the user deleted it"""
+    chat_id = job["chat_id"]
+    try:
+        status, = await get_source_messages(client, [{"chat_id": chat_id, "message_id": job["payload"]["status_id"]}])
+        return status
+    except ValueError:
+        return await limiter.call(chat_id, client.send_message, chat_id, "⏳ Processing...")
+
+async def upload_media(client: Client, chat_id: int, kind: str, path: str, **kwargs) -> Message:
+    """Send `path` back as a document, video or audio"""
+    send = {
+        "document": client.send_document,
+        "video": client.send_video,
+        "audio": client.send_audio,
+    }[kind]
+    return await limiter.call(chat_id, send, chat_id, path, **kwargs)
+
+async def enqueue_job(message: Message, db, kind: str, payload: Dict) -> Optional[Dict]:
+    """Acknowledge the command and hand the work to the job queue"""
+    if not coordinator.accepting:
+        await limiter.call(message.chat.id, message.reply_text, RESTARTING_TEXT)
+        return None
+    queue = JobQueue(db)
+    position = await queue.pending() + 1
+    status = await limiter.call(message.chat.id, message.reply_text, f"⏳ Queued (position {position})...")
+    return await queue.enqueue(kind, message.from_user.id, message.chat.id, {
+        **payload,
+        "status_id": status.id,
+        "command_id": message.id,
+        "username": message.from_user.username,
+    })
+
 # Command handlers
 @Client.on_message(filters.command(["rename", "r"]) & filters.reply)
 async def rename_file(client: Client, message: Message, db):
-    user_id = message.from_user.id
     replied = message.reply_to_message
-    settings = await get_user_settings(user_id, db)
     
     if not (replied.document or replied.video or replied.audio):
-        await message.reply_text("Please reply to a file, video, or audio message to rename.")
+        await limiter.call(message.chat.id, message.reply_text, "Please reply to a file, video, or audio message to rename.")
         return
     
     new_name = " ".join(message.command[1:])
     if not new_name:
-        await message.reply_text("Please provide a new name. Example: /rename NewFileName")
+        await limiter.call(message.chat.id, message.reply_text, "Please provide a new name. Example: /rename NewFileName")
         return
     
-    # Create temp directory
-    os.makedirs(TEMP_DIR, exist_ok=True)
+    await enqueue_job(message, db, "rename", {"new_name": new_name, "source": file_ref(replied)})
+
+@job_runner("rename")
+async def run_rename_job(client: Client, job: Dict, db):
+    payload = job["payload"]
+    chat_id = job["chat_id"]
+    source = payload["source"]
+    with span("telegram"):
+        status = await get_status_message(client, job)
+    with span("mongo"):
+        settings = await get_user_settings(job["user_id"], db)
+    workspace = job_workspace(job)
+    checkpoint = Checkpoint(db, job)
     
     # Apply prefix/suffix
-    file_ext = os.path.splitext(replied.document.file_name if replied.document else replied.video.file_name)[1]
-    new_name = await clean_filename(new_name)
+    file_ext = os.path.splitext(source["file_name"])[1]
+    new_name = await clean_filename(payload["new_name"])
     final_name = f"{settings.get('prefix', '')}{new_name}{settings.get('suffix', '')}{file_ext}"
     
-    # Download file
-    original_path = await client.download_media(replied, file_name=os.path.join(TEMP_DIR, f"original_{user_id}{file_ext}"))
-    processed_path = os.path.join(TEMP_DIR, f"processed_{user_id}{file_ext}")
-    
     try:
-        # Process file (watermark + metadata)
-        needs_processing = False
-        os.rename(original_path, processed_path)
-        
-        # Apply watermark
-        if settings.get("watermark_text"):
-            watermark_applied = await apply_watermark(processed_path, processed_path, settings)
-            needs_processing = needs_processing or watermark_applied
-        
-        # Apply metadata
-        if any(settings.get(key) for key in ["metadata_title", "metadata_artist", "metadata_album"]):
-            metadata_applied = await edit_metadata(processed_path, processed_path, settings)
-            needs_processing = needs_processing or metadata_applied
-        
-        # If no processing, use original
-        if not needs_processing:
-            os.rename(processed_path, original_path)
-            processed_path = original_path
-        
-        # Prepare thumbnail
-        thumb = None
-        if settings.get("thumbnail"):
-            thumb = BytesIO(settings["thumbnail"])
-            thumb.name = "thumbnail.jpg"
-        elif settings.get("auto_thumbnail", False):
-            thumb = await generate_thumbnail(processed_path)
-        
-        # Upload file
-        caption = f"📁 Renamed by @{message.from_user.username}\n🔹 Original: `{replied.document.file_name if replied.document else replied.video.file_name}`"
-        
-        if replied.document:
-            await client.send_document(
-                chat_id=message.chat.id,
-                document=processed_path,
-                file_name=final_name,
-                thumb=thumb,
-                caption=caption,
-                reply_to_message_id=replied.id
-            )
-        elif replied.video:
-            await client.send_video(
-                chat_id=message.chat.id,
-                video=processed_path,
-                file_name=final_name,
-                thumb=thumb,
-                caption=caption,
-                reply_to_message_id=replied.id
-            )
-        elif replied.audio:
-            await client.send_audio(
-                chat_id=message.chat.id,
-                audio=processed_path,
-                file_name=final_name,
-                thumb=thumb,
-                caption=caption,
-                reply_to_message_id=replied.id
-            )
-        
-        # Update stats
-        await update_user_settings(user_id, {
-            "rename_count": settings.get("rename_count", 0) + 1,
-            "last_activity": datetime.utcnow()
-        }, db)
+        if not checkpoint.reached("uploaded"):
+            with span("telegram"):
+                replied, = await get_source_messages(client, [source])
+            processed_path = checkpoint.output("processed_path")
+            if not processed_path:
+                limiter.detach(limiter.edit(
+                    status, "♻️ Resuming..." if checkpoint.resumed else "⏳ Downloading and processing file..."
+                ))
+                
+                # Download file
+                with span("download"):
+                    original_path = await source_cache.fetch(
+                        client, replied,
+                        file_name=os.path.join(workspace, f"original{file_ext}"),
+                        resume=checkpoint.download("original")
+                    )
+                processed_path = original_path
+                
+                # Apply watermark (ffmpeg can't write over its own input, so each step gets a new file)
+                if settings.get("watermark_text"):
+                    watermarked_path = os.path.join(workspace, f"watermarked{file_ext}")
+                    with span("watermark"):
+                        if await apply_watermark(processed_path, watermarked_path, settings):
+                            processed_path = watermarked_path
+                
+                # Apply metadata
+                if any(settings.get(key) for key in ["metadata_title", "metadata_artist", "metadata_album"]):
+                    tagged_path = os.path.join(workspace, f"tagged{file_ext}")
+                    with span("metadata"):
+                        if await edit_metadata(processed_path, tagged_path, settings):
+                            processed_path = tagged_path
+                
+                # No ffmpeg pass ran: move moov to the front ourselves (a cached
+                # source is shared, so it gets a relocated copy rather than a rewrite)
+                if processed_path == original_path and file_ext.lower() in mp4.MP4_EXTENSIONS:
+                    faststart_path = os.path.join(workspace, f"faststart{file_ext}")
+                    with span("faststart"):
+                        if await mp4.faststart(original_path, faststart_path):
+                            processed_path = faststart_path
+                
+                await checkpoint.complete("processed", processed_path=processed_path)
+            
+            # Duration and dimensions let clients stream the video without server-side processing
+            kind = media_kind(replied)
+            video_info = await mp4.probe(processed_path) if kind == "video" else {}
+            
+            # Prepare thumbnail
+            thumb = None
+            if settings.get("thumbnail"):
+                thumb = BytesIO(settings["thumbnail"])
+                thumb.name = "thumbnail.jpg"
+            elif settings.get("auto_thumbnail", False):
+                with span("thumbnail"):
+                    thumb = await generate_thumbnail(processed_path)
+            
+            # Upload file
+            caption = f"📁 Renamed by @{payload.get('username')}\n🔹 Original: `{source['file_name']}`"
+            with span("upload"):
+                await upload_media(
+                    client, chat_id, kind, processed_path,
+                    file_name=final_name,
+                    thumb=thumb,
+                    caption=caption,
+                    reply_to_message_id=replied.id,
+                    **video_info
+                )
+            await checkpoint.complete("uploaded")
+            
+            # Update stats
+            with span("mongo"):
+                await db.users.update_one(
+                    {"user_id": job["user_id"]},
+                    {"$inc": {"rename_count": 1}, "$set": {"last_activity": datetime.utcnow()}}
+                )
+        limiter.detach(limiter.delete(status))
         
     except Exception as e:
-        await message.reply_text(f"❌ Error: {str(e)}")
-    finally:
-        # Cleanup
-        for path in [original_path, processed_path]:
-            if path and os.path.exists(path):
-                os.remove(path)
+        await limiter.edit(status, f"❌ Error: {str(e)}")
+    
+    # Cleanup (an interrupted job never gets here and keeps its files for the retry)
+    remove_workspace(workspace)
 
 @Client.on_message(filters.command(["combine", "merge"]))
 async def combine_files_handler(client: Client, message: Message, db):
@@ -341,7 +448,8 @@ async def combine_files_handler(client: Client, message: Message, db):
     
     # Check if already in combine mode
     if settings.get("combine_mode"):
-        await message.reply_text(
+        await limiter.call(
+            message.chat.id, message.reply_text,
             "You're already in combine mode! Send files to combine.\n\n"
             "When done, use /finishcombine [output_name] to merge files.\n"
             "Or /cancelcombine to cancel."
@@ -353,7 +461,8 @@ async def combine_files_handler(client: Client, message: Message, db):
         file_type = os.path.splitext(message.reply_to_message.document.file_name if message.reply_to_message.document else message.reply_to_message.video.file_name)[1]
         
         if file_type not in SUPPORTED_COMBINE_TYPES:
-            await message.reply_text(
+            await limiter.call(
+                message.chat.id, message.reply_text,
                 f"File type {file_type} not supported for combining.\n"
                 f"Supported types: {', '.join(SUPPORTED_COMBINE_TYPES)}"
             )
@@ -363,11 +472,12 @@ async def combine_files_handler(client: Client, message: Message, db):
         await update_user_settings(user_id, {
             "combine_mode": True,
             "combine_type": file_type,
-            "combine_files": [message.reply_to_message],
+            "combine_files": [file_ref(message.reply_to_message)],
             "last_activity": datetime.utcnow()
         }, db)
         
-        await message.reply_text(
+        await limiter.call(
+            message.chat.id, message.reply_text,
             f"🔀 Combine mode started for {file_type} files.\n"
             "Send me more files of the same type to combine.\n\n"
             "When done, use /finishcombine [output_name] to merge files.\n"
@@ -375,14 +485,15 @@ async def combine_files_handler(client: Client, message: Message, db):
         )
     else:
         # Show combine help
-        await message.reply_text(
+        await limiter.call(
+            message.chat.id, message.reply_text,
             "🔀 **Combine Files**\n\n"
             "To combine multiple files into one:\n"
             "1. Reply to a file with /combine\n"
             "2. Send more files of the same type\n"
             "3. Use /finishcombine [output_name] when done\n\n"
             f"Supported types: {', '.join(SUPPORTED_COMBINE_TYPES)}\n"
-            f"Max combined size: {MAX_COMBINE_SIZE//(1024*1024)}MB"
+            f"Max combined size: {combine_limits_text()}"
         )
 
 @Client.on_message(filters.command(["finishcombine", "mergefinish"]))
@@ -391,12 +502,12 @@ async def finish_combine_handler(client: Client, message: Message, db):
     settings = await get_user_settings(user_id, db)
     
     if not settings.get("combine_mode"):
-        await message.reply_text("You're not in combine mode. Use /combine to start.")
+        await limiter.call(message.chat.id, message.reply_text, "You're not in combine mode. Use /combine to start.")
         return
     
     files = settings.get("combine_files", [])
     if len(files) < 2:
-        await message.reply_text("You need at least 2 files to combine. Send more files or /cancelcombine.")
+        await limiter.call(message.chat.id, message.reply_text, "You need at least 2 files to combine. Send more files or /cancelcombine.")
         return
     
     output_name = " ".join(message.command[1:])
@@ -407,82 +518,109 @@ async def finish_combine_handler(client: Client, message: Message, db):
     output_name = await clean_filename(output_name) + file_type
     
     # Check total size
-    total_size = sum(f.document.file_size if f.document else f.video.file_size for f in files)
-    if total_size > MAX_COMBINE_SIZE:
-        await message.reply_text(
-            f"Total size ({total_size//(1024*1024)}MB) exceeds limit ({MAX_COMBINE_SIZE//(1024*1024)}MB).\n"
+    total_size = sum(f["file_size"] for f in files)
+    limit = combine_limit(file_type)
+    if total_size > limit:
+        await limiter.call(
+            message.chat.id, message.reply_text,
+            f"Total size ({total_size//(1024*1024)}MB) exceeds limit ({limit//(1024*1024)}MB).\n"
             "Please try with fewer/smaller files."
         )
         return
     
-    # Download files
-    os.makedirs(TEMP_DIR, exist_ok=True)
-    temp_files = []
+    job = await enqueue_job(message, db, "combine", {
+        "files": files,
+        "file_type": file_type,
+        "output_name": output_name
+    })
+    if job is None:
+        return
+    
+    # The job carries its own copy of the file list, so combine mode can end now
+    await update_user_settings(user_id, {
+        "combine_mode": False,
+        "combine_type": "",
+        "combine_files": [],
+        "last_activity": datetime.utcnow()
+    }, db)
+
+@job_runner("combine")
+async def run_combine_job(client: Client, job: Dict, db):
+    payload = job["payload"]
+    chat_id = job["chat_id"]
+    files = payload["files"]
+    file_type = payload["file_type"]
+    output_name = payload["output_name"]
+    with span("telegram"):
+        status = await get_status_message(client, job)
+    workspace = job_workspace(job)
+    checkpoint = Checkpoint(db, job)
+    output_path = os.path.join(workspace, output_name)
     
     try:
-        processing_msg = await message.reply_text("⏳ Downloading and processing files...")
-        
-        for i, file_msg in enumerate(files):
-            file_path = await client.download_media(
-                file_msg,
-                file_name=os.path.join(TEMP_DIR, f"combine_{user_id}_{i}{file_type}")
-            )
-            temp_files.append(file_path)
-        
-        # Combine files
-        output_path = os.path.join(TEMP_DIR, output_name)
-        await processing_msg.edit_text("🔄 Combining files...")
-        
-        if await combine_files(temp_files, output_path, file_type):
+        if not checkpoint.reached("uploaded"):
+            with span("telegram"):
+                file_msgs = await get_source_messages(client, files)
+            if not (checkpoint.reached("combined") and os.path.exists(output_path)):
+                limiter.detach(limiter.edit(
+                    status, "♻️ Resuming..." if checkpoint.resumed else "⏳ Downloading and processing files..."
+                ))
+                
+                async def download_input(i: int, file_msg: Message) -> str:
+                    return await source_cache.fetch(
+                        client,
+                        file_msg,
+                        file_name=os.path.join(workspace, f"combine_{i}{file_type}"),
+                        resume=checkpoint.download(f"input_{i}")
+                    )
+                
+                if streams_combine(file_type):
+                    # Inputs are piped into ffmpeg as they arrive; only the output hits the disk
+                    limiter.detach(limiter.edit(status, "🔄 Downloading and combining files..."))
+                    with span("combine"):
+                        combined = await stream_combine_files(
+                            client, file_msgs, output_path, file_type, workspace, download_input
+                        )
+                else:
+                    with span("download"):
+                        temp_files = [await download_input(i, file_msg) for i, file_msg in enumerate(file_msgs)]
+                    
+                    # Combine files
+                    limiter.detach(limiter.edit(status, "🔄 Combining files..."))
+                    
+                    with span("combine"):
+                        combined = await combine_files(temp_files, output_path, file_type)
+                if not combined:
+                    await limiter.edit(status, "❌ Failed to combine files.")
+                    remove_workspace(workspace)
+                    return
+                await checkpoint.complete("combined")
+            
             # Get final size
             final_size = os.path.getsize(output_path)
+            kind = {".mp4": "video", ".mp3": "audio"}.get(file_type, "document")
+            video_info = await mp4.probe(output_path) if kind == "video" else {}
             
             # Send combined file
-            await processing_msg.edit_text("📤 Uploading combined file...")
+            limiter.detach(limiter.edit(status, "📤 Uploading combined file..."))
             
-            if file_type == ".mp4":
-                await client.send_video(
-                    chat_id=message.chat.id,
-                    video=output_path,
-                    file_name=output_name,
-                    caption=f"🔀 Combined {len(files)} files\n"
-                          f"📦 Size: {final_size//1024}KB"
-                )
-            elif file_type == ".mp3":
-                await client.send_audio(
-                    chat_id=message.chat.id,
-                    audio=output_path,
+            with span("upload"):
+                await upload_media(
+                    client, chat_id, kind, output_path,
                     file_name=output_name,
                     caption=f"🔀 Combined {len(files)} files\n"
-                          f"📦 Size: {final_size//1024}KB"
+                          f"📦 Size: {final_size//1024}KB",
+                    **video_info
                 )
-            elif file_type == ".pdf":
-                await client.send_document(
-                    chat_id=message.chat.id,
-                    document=output_path,
-                    file_name=output_name,
-                    caption=f"🔀 Combined {len(files)} files\n"
-                          f"📦 Size: {final_size//1024}KB"
-                )
-            
-            await processing_msg.delete()
-        else:
-            await message.reply_text("❌ Failed to combine files.")
+            await checkpoint.complete("uploaded")
         
-    except Exception as e:
-        await message.reply_text(f"❌ Error: {str(e)}")
-    finally:
-        # Cleanup and reset combine mode
-        for file_path in temp_files + [output_path]:
-            if file_path and os.path.exists(file_path):
-                os.remove(file_path)
+        limiter.detach(limiter.delete(status))
         
-        await update_user_settings(user_id, {
-            "combine_mode": False,
-            "combine_type": "",
-            "combine_files": [],
-            "last_activity": datetime.utcnow()
-        }, db)
+    except Exception as e:
+        await limiter.edit(status, f"❌ Error: {str(e)}")
+    
+    # Cleanup (an interrupted job never gets here and keeps its files for the retry)
+    remove_workspace(workspace)
 
 @Client.on_message(filters.command(["cancelcombine", "mergecancel"]))
 async def cancel_combine_handler(client: Client, message: Message, db):
@@ -496,9 +634,9 @@ async def cancel_combine_handler(client: Client, message: Message, db):
             "combine_files": [],
             "last_activity": datetime.utcnow()
         }, db)
-        await message.reply_text("✅ Combine mode canceled.")
+        await limiter.call(message.chat.id, message.reply_text, "✅ Combine mode canceled.")
     else:
-        await message.reply_text("You're not in combine mode.")
+        await limiter.call(message.chat.id, message.reply_text, "You're not in combine mode.")
 
 @Client.on_message(filters.command(["setwatermark", "wm"]))
 async def set_watermark_handler(client: Client, message: Message, db):
@@ -506,7 +644,8 @@ async def set_watermark_handler(client: Client, message: Message, db):
     text = " ".join(message.command[1:])
     
     if not text:
-        await message.reply_text(
+        await limiter.call(
+            message.chat.id, message.reply_text,
             "Please provide watermark text. Example: /setwatermark MyWatermark\n\n"
             "Options:\n"
             "position=top-left|top-right|bottom-left|bottom-right|center\n"
@@ -543,7 +682,8 @@ async def set_watermark_handler(client: Client, message: Message, db):
         "last_activity": datetime.utcnow()
     }, db)
     
-    await message.reply_text(
+    await limiter.call(
+        message.chat.id, message.reply_text,
         f"✅ Watermark settings updated:\n"
         f"Text: `{text}`\n"
         f"Position: `{position}`\n"
@@ -557,7 +697,8 @@ async def set_metadata_handler(client: Client, message: Message, db):
     args = " ".join(message.command[1:])
     
     if not args:
-        await message.reply_text(
+        await limiter.call(
+            message.chat.id, message.reply_text,
             "Please provide metadata to set. Example:\n"
             "/setmetadata title=\"My Title\" artist=\"My Artist\" album=\"My Album\""
         )
@@ -571,7 +712,7 @@ async def set_metadata_handler(client: Client, message: Message, db):
             metadata[key.strip()] = val.strip(' "')
     
     if not metadata:
-        await message.reply_text("Invalid format. Use: /setmetadata title=\"My Title\" artist=\"Name\"")
+        await limiter.call(message.chat.id, message.reply_text, "Invalid format. Use: /setmetadata title=\"My Title\" artist=\"Name\"")
         return
     
     update_data = {"last_activity": datetime.utcnow()}
@@ -583,30 +724,62 @@ async def set_metadata_handler(client: Client, message: Message, db):
         update_data["metadata_album"] = metadata["album"]
     
     await update_user_settings(user_id, update_data, db)
-    await message.reply_text("✅ Metadata settings updated.")
+    await limiter.call(message.chat.id, message.reply_text, "✅ Metadata settings updated.")
 
 @Client.on_message(filters.command(["showmetadata", "fileinfo"]))
 async def show_metadata_handler(client: Client, message: Message, db):
     if not message.reply_to_message or not (message.reply_to_message.document or message.reply_to_message.video or message.reply_to_message.audio):
-        await message.reply_text("Please reply to a file to show its metadata.")
+        await limiter.call(message.chat.id, message.reply_text, "Please reply to a file to show its metadata.")
         return
     
-    # Download file
-    file_path = await client.download_media(message.reply_to_message)
-    metadata = await get_metadata(file_path)
+    await enqueue_job(message, db, "metadata", {"source": file_ref(message.reply_to_message)})
+
+@job_runner("metadata")
+async def run_metadata_job(client: Client, job: Dict, db):
+    payload = job["payload"]
+    source = payload["source"]
+    with span("telegram"):
+        status = await get_status_message(client, job)
+    workspace = job_workspace(job)
     
-    if not metadata:
-        await message.reply_text("No metadata found or could not extract metadata.")
-    else:
-        metadata_text = "📋 **File Metadata**\n\n"
-        for key, value in metadata.items():
-            metadata_text += f"🔹 {key.capitalize()}: `{value}`\n"
+    try:
+        with span("telegram"):
+            replied, = await get_source_messages(client, [source])
+        # Download file
+        with span("download"):
+            file_path = await source_cache.fetch(
+                client, replied,
+                file_name=os.path.join(workspace, f"source{os.path.splitext(source['file_name'])[1]}"),
+                resume=Checkpoint(db, job).download("source")
+            )
+        with span("metadata"):
+            metadata = await get_metadata(file_path)
         
-        await message.reply_text(metadata_text)
+        if not metadata:
+            await limiter.edit(status, "No metadata found or could not extract metadata.")
+        else:
+            metadata_text = "📋 **File Metadata**\n\n"
+            for key, value in metadata.items():
+                metadata_text += f"🔹 {key.capitalize()}: `{value}`\n"
+            
+            await limiter.edit(status, metadata_text)
+    except Exception as e:
+        await limiter.edit(status, f"❌ Error: {str(e)}")
     
-    # Cleanup
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    # Cleanup (an interrupted job never gets here and keeps its files for the retry)
+    remove_workspace(workspace)
+
+@Client.on_message(filters.command(["queue"]))
+async def queue_handler(client: Client, message: Message):
+    stats = await JobQueue(db).stats()
+    await limiter.call(
+        message.chat.id, message.reply_text,
+        "📊 **Job Queue**\n\n"
+        f"🔹 Queued: {stats['queued']}\n"
+        f"🔹 Running: {stats['running']}\n"
+        f"🔹 Workers online: {stats['workers']}\n"
+        f"🔹 Busy slots: {stats['busy']}/{stats['slots']}"
+    )
 
 @Client.on_message(filters.command(["settings", "myoptions"]))
 async def settings_handler(client: Client, message: Message, db):
@@ -633,4 +806,4 @@ async def settings_handler(client: Client, message: Message, db):
         f"🔹 Total Renames: {settings.get('rename_count', 0)}"
     )
     
-    await message.reply_text(text)
+    await limiter.call(message.chat.id, message.reply_text, text)
@@ -1,9 +1,11 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from helpers.ratelimit import limiter
+from plugins.rename import combine_limits_text
 
 @Client.on_message(filters.command(["start", "help"]))
 async def help_command(client: Client, message: Message):
-    help_text = """
+    help_text = f"""
 🤖 **Advanced File Rename Bot**  
 *With Watermarking, Metadata Editing & File Combining*
 
@@ -18,6 +20,7 @@ async def help_command(client: Client, message: Message):
 /start - Show this help message  
 /help - Show detailed help  
 /settings - View your current settings  
+/queue - Show job queue length and workers  
 
 🔄 **File Renaming:**
 /rename [new_name] - Rename a file (reply to file)  
@@ -51,7 +54,7 @@ async def help_command(client: Client, message: Message):
 /setsuffix [text] - Set filename suffix  
 
 📊 **Current Limitations:**
-- Max combined file size: 500MB  
+- Max combined file size: {combine_limits_text()}  
 - Supported combine types: MP4, MP3, PDF  
 - Watermark font: Arial (default)  
 
@@ -74,7 +77,8 @@ Contact @YourSupportChannel for assistance
         ]
     ])
 
-    await message.reply_text(
+    await limiter.call(
+        message.chat.id, message.reply_text,
         help_text,
         reply_markup=keyboard,
         disable_web_page_preview=True
@@ -148,7 +152,7 @@ Reply to a file with `/showmetadata`
 Metadata editing works when using /rename command
 """
     elif data == "help_combine":
-        text = """
+        text = f"""
 🔀 **File Combining Help**
 
 Combine multiple files into one:
@@ -164,7 +168,7 @@ Combine multiple files into one:
 3. Use `/finishcombine OutputName` when done
 
 ⚙️ **Options:**
-- Max combined size: 500MB  
+- Max combined size: {combine_limits_text()}  
 - Use `/cancelcombine` to abort  
 
 🔹 **Example:**
@@ -175,7 +179,8 @@ Combine multiple files into one:
     else:
         text = "ℹ️ Select a help topic from the buttons"
 
-    await callback_query.edit_message_text(
+    await limiter.call(
+        callback_query.message.chat.id, callback_query.edit_message_text,
         text,
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton("« Back to Main Help", callback_data="back_to_main")]
@@ -189,4 +194,4 @@ async def back_to_main(client: Client, callback_query):
 
 @Client.on_callback_query(filters.regex("^close_help$"))
 async def close_help(client: Client, callback_query):
-    await callback_query.message.delete()
+    await limiter.delete(callback_query.message)
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import os
+import socket
+from pyrogram import Client, idle
+from pyrogram import utils as pyroutils
+from config import BOT, API, QUEUE
+from helpers import transfer
+from helpers.checkpoint import sweep_workspaces
+from helpers.source_cache import sweep_orphans
+from helpers.jobqueue import Worker
+from helpers.shutdown import coordinator
+from helpers.tracing import tracer
+
+# ✅ Peer ID Fix (for large channel/group IDs)
+pyroutils.MIN_CHAT_ID = -999999999999
+pyroutils.MIN_CHANNEL_ID = -10099999999999
+
+# ------------------ Logging Setup ------------------
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger("pyrogram").setLevel(logging.ERROR)
+
+# ------------------ Worker Client ------------------
+class MN_Worker(transfer.ParallelUploadMixin, Client):
+    """Headless bot session that only runs queued jobs (no command handlers)"""
+
+    def __init__(self, name: str):
+        super().__init__(
+            name,
+            api_id=API.ID,
+            api_hash=API.HASH,
+            bot_token=BOT.TOKEN,
+            no_updates=True,
+        )
+
+async def main():
+    # Registers the job runners; the plugin handlers stay unattached
+    from plugins.rename import db, TEMP_DIR, source_cache
+
+    # Stable across restarts so the session file (and bot login) is reused
+    name = os.environ.get("WORKER_NAME", f"MN-Worker-{socket.gethostname()}")
+    client = MN_Worker(name)
+    await client.start()
+    tracer.start_monitor()
+    await sweep_workspaces(db, TEMP_DIR)
+    # Its own cache directory, so it never evicts a file the bot process is still handing out;
+    # named after the worker, so a restart finds its cached and partial downloads again
+    source_cache.open(os.path.join(TEMP_DIR, f"source_cache_{name}"))
+    sweep_orphans(TEMP_DIR)
+    worker = Worker(client, db, QUEUE.WORKER_SLOTS, worker_id=name)
+    worker.start()
+    logging.info(f"✅ {name} running {QUEUE.WORKER_SLOTS} job slots")
+    try:
+        await idle()
+    finally:
+        await coordinator.shutdown(client, worker, workspaces=TEMP_DIR)
+        await client.stop()
+        logging.info(f"{name} stopped")
+
+# ------------------ Main ------------------
+if __name__ == "__main__":
+    asyncio.run(main())